@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""Vectorises many pictures, e.g. a directory, with a pool of processes
+which each import the modules once and process whole pictures"""
+import argparse
+import collections
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import main
+
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff",
+              ".npy")  # Pictures found in a directory
+# Options of main.main which do not change the output
+UNRECORDED = ("cache", "cache_size")
+
+
+def inputs(source):
+    """Sorted list of pictures of source
+    source -- directory, whose files with EXTENSIONS are taken, or glob
+        pattern
+    """
+    if os.path.isdir(source):
+        files = [os.path.join(source, name) for name in os.listdir(source)
+                 if name.lower().endswith(EXTENSIONS)]
+    else:
+        files = glob.glob(source, recursive=True)
+    return sorted(name for name in files if os.path.isfile(name))
+
+
+def output_names(files, outdir, extension=".svg"):
+    """Names of the outputs of files in outdir: name of the picture without
+    its extension, then extension. Pictures which would get the same output
+    (same name in several directories, or with several extensions) keep
+    their extension and their path from the common directory of files,
+    separators being replaced by "__". A number is added to names still
+    taken.
+    returns -- list of names, in the order of files
+    """
+    stems = [os.path.splitext(os.path.basename(name))[0] for name in files]
+    counts = collections.Counter(stems)
+    common = os.path.commonpath([os.path.abspath(os.path.dirname(name))
+                                 for name in files]) if files else ""
+    names = []
+    taken = set()
+    for name, stem in zip(files, stems):
+        if counts[stem] > 1:
+            stem = os.path.relpath(os.path.abspath(name), common).replace(
+                os.sep, "__")
+        output, number = stem + extension, 1
+        while output in taken:
+            output = "{}-{}{}".format(stem, number, extension)
+            number += 1
+        taken.add(output)
+        names.append(os.path.join(outdir, output))
+    return names
+
+
+def options_name(output):
+    """Name of the file of the options output was made with"""
+    return os.path.join(os.path.dirname(output),
+                        "." + os.path.basename(output) + ".options")
+
+
+def recorded(options):
+    """Options of main.main changing the output, as stored in the file of
+    options_name"""
+    return json.dumps({name: value for name, value in options.items()
+                       if name not in UNRECORDED}, sort_keys=True)
+
+
+def uptodate(imagefile, output, options):
+    """Whether output exists, is newer than imagefile and was made with
+    options, keyword arguments of main.main"""
+    if not os.path.exists(output) or \
+            os.path.getmtime(output) < os.path.getmtime(imagefile):
+        return False
+    try:
+        with open(options_name(output)) as former:
+            return former.read() == recorded(options)
+    except FileNotFoundError:  # Made before options were recorded
+        return False
+
+
+def vectorise(task):
+    """Vectorises a picture in a worker, never raises
+    task -- (imagefile, output, keyword arguments of main.main)
+    returns -- (imagefile, error message or None, seconds)
+    """
+    imagefile, output, options = task
+    start = time.perf_counter()
+    # Written under another name then renamed, an interrupted run does not
+    # leave an output which seems up to date
+    partial = os.path.join(os.path.dirname(output),
+                           ".partial-" + os.path.basename(output))
+    try:
+        main.main(imagefile, output=partial, verbose=False, **options)
+        os.replace(partial, output)
+        # Written after the output, an interrupted run leaves former options
+        with open(options_name(output), "w") as made:
+            made.write(recorded(options))
+        error = None
+    except Exception:
+        error = traceback.format_exc().strip().splitlines()[-1]
+        if os.path.exists(partial):
+            os.remove(partial)
+    return imagefile, error, time.perf_counter() - start
+
+
+def batch(source, outdir, ngreys, jobs=None, force=False, compress=False,
+          **options):
+    """Vectorises the pictures of source into outdir, printing progress
+    source -- directory or glob pattern, see inputs
+    outdir -- directory of the outputs, created if needed
+    ngreys -- number of greylevels to keep
+    jobs -- number of processes, all processors by default
+    force -- whether outputs which are up to date, newer than their picture
+        and made with the same options, are vectorised again
+    compress -- whether outputs are .svgz
+    options -- other keyword arguments of main.main
+    returns -- list of (imagefile, error message) of failures
+    """
+    main.check_options(**options)
+    files = inputs(source)
+    outputs = output_names(files, outdir, ".svgz" if compress else ".svg")
+    os.makedirs(outdir, exist_ok=True)
+    options["ngreys"] = ngreys
+    tasks = [(imagefile, output, options)
+             for imagefile, output in zip(files, outputs)
+             if force or not uptodate(imagefile, output, options)]
+    print("{} pictures, {} up to date".format(
+        len(files), len(files) - len(tasks)))
+    failures = []
+    with multiprocessing.Pool(jobs) as pool:
+        results = pool.imap_unordered(vectorise, tasks)
+        for done, (imagefile, error, seconds) in enumerate(results, 1):
+            if error is None:
+                status = "ok"
+            else:
+                status = "FAILED " + error
+                failures.append((imagefile, error))
+            print("[{}/{}] {} {} ({:.2f} s)".format(
+                done, len(tasks), imagefile, status, seconds), flush=True)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source",
+                        help="Directory of pictures, or glob pattern")
+    parser.add_argument("outdir", help="Directory of the svg files")
+    parser.add_argument("ngls", type=int, help="Number of greylevels to keep")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of processes, all processors by default")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Vectorise pictures whose svg is up to date")
+    parser.add_argument("-z", "--svgz", action="store_true",
+                        help="Compress the svg files")
+    parser.add_argument("-d", "--decimals", type=int,
+                        help="Compact relative paths with so many decimals")
+    parser.add_argument("-m", "--merge", action="store_true",
+                        help="Merge paths of a same colour")
+    parser.add_argument("-a", "--min-area", type=int, default=1,
+                        help="Zones of less pixels are merged into a "
+                        "neighbour")
+    parser.add_argument("-s", "--simplify", type=float,
+                        help="Fewer curves, the contour being simplified "
+                        "within so many pixels")
+    parser.add_argument("-e", "--max-error", type=float,
+                        help="Fewest curves within so many pixels of the "
+                        "contour, fitted by least squares")
+    parser.add_argument("-t", "--topological", action="store_true",
+                        help="Fit borders shared by two zones once, zones "
+                        "having no gaps nor overlaps")
+    parser.add_argument("-n", "--nested", action="store_true",
+                        help="Paint zones after the ones around them, "
+                        "which have holes: less overdraw, larger file")
+    parser.add_argument("--cache",
+                        help="Directory where results of stages are kept "
+                        "for later runs")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Megabytes of the cache")
+    args = parser.parse_args()
+    options = dict(decimals=args.decimals, merge=args.merge,
+                   min_area=args.min_area, simplify=args.simplify,
+                   max_error=args.max_error, cache=args.cache,
+                   cache_size=args.cache_size << 20,
+                   topological=args.topological, nested=args.nested)
+    try:
+        main.check_options(**options)
+    except ValueError as error:
+        parser.error(str(error))
+    failures = batch(args.source, args.outdir, args.ngls, jobs=args.jobs,
+                     force=args.force, compress=args.svgz, **options)
+    if failures:
+        print("{} failures".format(len(failures)))
+    sys.exit(1 if failures else 0)
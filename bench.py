@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""Benchmarks of the stages of the vectorisation on synthetic pictures:
+time, throughput and peak memory of each stage, for several sizes, saved as
+JSON and compared to a baseline"""
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import scipy.ndimage
+import image_processing
+import control_points
+import writesvg
+
+SIZES = (64, 128, 256)
+TOLERANCE = 0.25  # Relative slow down or memory increase flagged
+# Increases too small to be told from noise, whatever the tolerance
+NOISE = {"seconds": 2e-3, "peak_bytes": 1 << 16}
+
+
+def concentric(size, rings=8, seed=0):
+    """Concentric discs of random colours"""
+    colours = np.random.default_rng(seed).integers(0, 256, (rings, 3))
+    x, y = np.mgrid[0:size, 0:size] - (size - 1) / 2
+    radius = np.hypot(x, y) / (size / 2) * rings
+    return colours[np.minimum(radius, rings - 1).astype(int)].astype(np.uint8)
+
+
+def blobs(size, scale=8, seed=0):
+    """Noise smoothed over about scale pixels, i.e. blobs of random shapes"""
+    noise = np.random.default_rng(seed).random((size, size, 3))
+    smooth = scipy.ndimage.gaussian_filter(noise, (scale, scale, 0))
+    smooth -= smooth.min()
+    return (255 * smooth / smooth.max()).astype(np.uint8)
+
+
+def gradient(size, seed=0):
+    """Diagonal gradient from black to white"""
+    x, y = np.mgrid[0:size, 0:size]
+    grey = (255 * (x + y) / max(2 * size - 2, 1)).astype(np.uint8)
+    return np.repeat(grey[:, :, np.newaxis], 3, axis=2)
+
+
+def mosaic(size, cell=4, seed=0):
+    """Many small regions: squares of cell pixels of random colours"""
+    cells = -(-size // cell)
+    colours = np.random.default_rng(seed).integers(
+        0, 256, (cells, cells, 3)).astype(np.uint8)
+    return np.repeat(np.repeat(colours, cell, axis=0), cell, axis=1)[
+        :size, :size]
+
+
+GENERATORS = {"concentric": concentric, "blobs": blobs, "gradient": gradient,
+              "mosaic": mosaic}
+
+
+def measure(function, repeat=1):
+    """Runs function repeat times for the best time, then once more to
+    measure its peak memory with tracemalloc, which slows it down
+    returns -- (result, seconds, peak bytes)
+    """
+    if repeat < 1:
+        raise ValueError("repeat must be at least 1")
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = min(seconds, time.perf_counter() - start)
+    del result
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_picture(matrgb, ngl=8, repeat=1):
+    """Times each stage of the vectorisation of matrgb
+    returns -- dictionnary of stages, each one a dictionnary of seconds,
+        peak_bytes and throughput, in pixels or contour points per second
+    """
+    pixels = matrgb.shape[0] * matrgb.shape[1]
+    stages = {}
+
+    def stage(name, function, items):
+        """Measures a stage, items being the pixels or points it processes"""
+        result, seconds, peak = measure(function, repeat)
+        stages[name] = {"seconds": seconds, "peak_bytes": peak,
+                        "throughput": items / max(seconds, 1e-9)}
+        return result
+
+    matgl = stage("pic2greylvl",
+                  lambda: image_processing.pic2greylvl(matrgb), pixels)
+    matq = stage("colourgrouping",
+                 lambda: image_processing.colourgrouping(matgl, ngl), pixels)
+    labels, stats = stage(
+        "label_regions",
+        lambda: image_processing.label_regions(matq, matrgb), pixels)
+    contours = stage("detection_contour", lambda: [
+        image_processing.detection_contour(labels, stats, label)
+        for label in range(len(stats["area"]))], pixels)
+    image_processing.ordercontlist(contours)
+    points = sum(len(contour) for contour in contours)
+    curvemats = stage("curvematc", lambda: [
+        control_points.curvematc(contour) for contour in contours], points)
+
+    def write():
+        """Writes the SVG in memory, returns its size"""
+        out = io.BytesIO()
+        svgfile = writesvg.SvgFile(out, matrgb.shape)
+        for contour, curvemat in zip(contours, curvemats):
+            colours = {"fill": contour.colour, "stroke": contour.colour}
+            svgfile.draw_contourc(curvemat, colours)
+        svgfile.close_svg()
+        return len(out.getvalue())
+    stage("svg", write, points)
+    stages["total"] = {
+        "seconds": sum(stage["seconds"] for stage in stages.values()),
+        "peak_bytes": max(stage["peak_bytes"] for stage in stages.values()),
+        "contours": len(contours), "points": points}
+    stages["total"]["throughput"] = pixels / stages["total"]["seconds"]
+    return stages
+
+
+def run(kinds=tuple(GENERATORS), sizes=SIZES, ngl=8, repeat=1):
+    """Benchmarks each kind of picture at each size
+    returns -- {kind: {size: stages}}, sizes as strings (JSON keys)
+    """
+    return {kind: {str(size): bench_picture(GENERATORS[kind](size), ngl,
+                                            repeat)
+                   for size in sizes}
+            for kind in kinds}
+
+
+def scaling(bykind):
+    """Exponent of the time of each stage as a power of the number of pixels,
+    fitted on the sizes of a kind of picture (1 is linear)
+    bykind -- {size: stages}, see run
+    """
+    sizes = sorted(bykind, key=int)
+    if len(sizes) < 2:
+        return {}
+    logpixels = 2 * np.log([int(size) for size in sizes])
+    return {name: float(np.polyfit(logpixels, np.log(
+        [max(bykind[size][name]["seconds"], 1e-9) for size in sizes]), 1)[0])
+            for name in bykind[sizes[0]]}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Lists the stages slower or using more memory than in baseline by more
+    than tolerance (relative) and NOISE
+    returns -- list of strings describing regressions
+    """
+    regressions = []
+    for kind, bykind in results.items():
+        for size, stages in bykind.items():
+            for name, stage in stages.items():
+                try:
+                    old = baseline[kind][size][name]
+                except KeyError:
+                    continue
+                for key in ("seconds", "peak_bytes"):
+                    if stage[key] > old[key] * (1 + tolerance) and \
+                            stage[key] > old[key] + NOISE[key]:
+                        regressions.append(
+                            "{} {} {}: {} {:.4g} -> {:.4g} ({:+.0%})".format(
+                                kind, size, name, key, old[key], stage[key],
+                                stage[key] / old[key] - 1))
+    return regressions
+
+
+def report(results):
+    """Prints a table of the results and the scaling of each stage"""
+    for kind, bykind in results.items():
+        names = list(next(iter(bykind.values())))
+        print(kind)
+        print("{:>6} ".format("size") +
+              " ".join("{:>17}".format(name) for name in names))
+        for size, stages in bykind.items():
+            print("{:>6} ".format(size) + " ".join(
+                "{:>8.4f}s {:>6.1f}M".format(
+                    stages[name]["seconds"], stages[name]["peak_bytes"] / 1e6)
+                for name in names))
+        exponents = scaling(bykind)
+        if exponents:
+            print("{:>6} ".format("scale") + " ".join(
+                "{:>17.2f}".format(exponents[name]) for name in names))
+        for size, stages in bykind.items():
+            print("{:>6}  {:.3g} pixels/s, {} contours, {} points, "
+                  "{:.3g} points/s fitted".format(
+                      size, stages["total"]["throughput"],
+                      stages["total"]["contours"], stages["total"]["points"],
+                      stages["curvematc"]["throughput"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--kinds", nargs="+", default=list(GENERATORS),
+                        choices=list(GENERATORS), help="Pictures generated")
+    parser.add_argument("-s", "--sizes", nargs="+", type=int,
+                        default=list(SIZES), help="Sides of the pictures")
+    parser.add_argument("-n", "--ngls", type=int, default=8,
+                        help="Number of greylevels to keep")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+                        help="Runs of each stage, the best one is kept")
+    parser.add_argument("-o", "--output", help="JSON file of the results")
+    parser.add_argument("-b", "--baseline", help="JSON file of former results")
+    parser.add_argument("-t", "--tolerance", type=float, default=TOLERANCE,
+                        help="Relative slow down flagged as a regression")
+    args = parser.parse_args()
+    try:
+        results = run(args.kinds, args.sizes, args.ngls, args.repeat)
+    except ValueError as error:
+        parser.error(str(error))
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the intermediate results of contours_image, keyed by the
+content of the picture and the parameters of each stage: greylevels,
+quantized greylevels, labels and ordered contours. A stage is only computed
+when it is not cached, from the previous one, loaded or computed likewise,
+so that changing a parameter only reruns the stages depending on it.
+Results are .npy files, memory mapped when loaded, listed by a manifest
+written last, and the least recently used ones are removed above a size
+cap.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+import image_elements
+import image_processing
+import instrument
+
+MAX_BYTES = 1 << 30  # Default size cap
+HASH_CHUNK = 1 << 24  # Bytes of the picture hashed at once
+# Part of every key, to be increased when the arrays of a stage change, so
+# that results of former versions are never loaded
+FORMAT_VERSION = 1
+MANIFEST = "manifest.txt"  # Names of the arrays of a result
+
+
+def image_key(matrgb):
+    """Hash of the content of a picture, read by chunks of rows if it is
+    memory mapped"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("{} {}".format(matrgb.shape, matrgb.dtype.str).encode())
+    step = max(HASH_CHUNK // max(matrgb[:1].nbytes, 1), 1)
+    for i in range(0, len(matrgb), step):
+        digest.update(np.ascontiguousarray(matrgb[i:i + step]).data)
+    return digest.hexdigest()
+
+
+class Cache(object):
+    """Directory of cached results, one subdirectory of .npy files by
+    result, whose modification time is its last use"""
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        """
+        directory -- created if needed
+        max_bytes -- size above which least recently used results are
+            removed
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, imagekey, stage, params):
+        """Name of the result of stage with params on picture imagekey"""
+        name = "{} {} {} {!r}".format(FORMAT_VERSION, imagekey, stage, params)
+        return hashlib.blake2b(name.encode(), digest_size=16).hexdigest()
+
+    def load(self, key):
+        """Dictionnary of the memory mapped arrays of result key, None if it
+        is not cached or not complete, e.g. while another process removes
+        it"""
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, MANIFEST)) as manifest:
+                names = manifest.read().split()
+            arrays = {name: np.load(os.path.join(path, name + ".npy"),
+                                    mmap_mode='r')
+                      for name in names}
+            os.utime(path)
+        except FileNotFoundError:  # Not cached, or just removed
+            return None
+        return arrays
+
+    def store(self, key, arrays):
+        """Saves the dictionnary of arrays as result key, then removes least
+        recently used results above max_bytes"""
+        # Written aside then renamed, so that another process never loads a
+        # partial result
+        partial = tempfile.mkdtemp(prefix=".partial-", dir=self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(partial, name + ".npy"), array)
+        with open(os.path.join(partial, MANIFEST), "w") as manifest:
+            manifest.write("\n".join(arrays))
+        try:
+            os.rename(partial, os.path.join(self.directory, key))
+        except OSError:  # Stored meanwhile by another process
+            shutil.rmtree(partial, ignore_errors=True)
+        self.evict()
+
+    def size(self, key):
+        """Bytes of result key"""
+        path = os.path.join(self.directory, key)
+        return sum(os.path.getsize(os.path.join(path, name))
+                   for name in os.listdir(path))
+
+    def evict(self):
+        """Removes least recently used results until the cache holds at most
+        max_bytes"""
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith("."):
+                continue
+            try:
+                entries.append((os.path.getmtime(
+                    os.path.join(self.directory, key)), self.size(key), key))
+            except FileNotFoundError:  # Removed by another process
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.directory, key),
+                          ignore_errors=True)
+            total -= size
+
+    def stage(self, imagekey, stage, params, compute):
+        """Loads the result of stage, or computes it with compute, a function
+        returning a dictionnary of arrays, and stores it"""
+        key = self.key(imagekey, stage, params)
+        arrays = self.load(key)
+        if arrays is not None:
+            instrument.RECORDER.count("cache hits")
+            return arrays
+        instrument.RECORDER.count("cache misses")
+        arrays = compute()
+        self.store(key, arrays)
+        return arrays
+
+
+def pack_contours(contlist):
+    """Arrays of a list of contours and their holes: coordinates of all
+    contours end to end, their lengths, colours ("" for holes) and owners
+    (index of the contour of a hole, -1 for contours)"""
+    allconts, owners = list(contlist), [-1] * len(contlist)
+    for index, contour in enumerate(contlist):
+        allconts.extend(contour.holes)
+        owners.extend([index] * len(contour.holes))
+    xys = np.concatenate([contour.xys for contour in allconts]) if allconts \
+        else np.empty((0, 2), dtype=np.int32)
+    return {"xys": xys,
+            "lengths": np.array([len(contour) for contour in allconts],
+                                dtype=np.int64),
+            "colours": np.array([contour.colour or "" for contour in allconts],
+                                dtype="<U7"),
+            "owners": np.array(owners, dtype=np.int64)}
+
+
+def unpack_contours(arrays):
+    """List of contours packed by pack_contours, whose coordinates are views
+    on arrays["xys"]"""
+    ends = np.cumsum(arrays["lengths"])
+    contlist = []
+    for end, length, colour, owner in zip(
+            ends.tolist(), arrays["lengths"].tolist(),
+            arrays["colours"].tolist(), arrays["owners"].tolist()):
+        contour = image_elements.Contour(())
+        contour.xys = arrays["xys"][end - length:end]
+        if owner < 0:
+            contour.colour = colour
+            contlist.append(contour)
+        else:
+            contlist[owner].holes.append(contour)
+    return contlist
+
+
+def contours_image(matrgb, cache, ngl=8, holes=False, min_area=1):
+    """Same as image_processing.contours_image followed by ordercontlist,
+    results of the stages being taken from cache when possible
+    cache -- Cache()
+    """
+    recorder = instrument.RECORDER
+    with recorder.stage("image_key"):
+        imagekey = image_key(matrgb)
+
+    def greylevels():
+        with recorder.stage("pic2greylvl"):
+            return {"matgl": image_processing.pic2greylvl(matrgb)}
+
+    def quantized():
+        matgl = cache.stage(imagekey, "pic2greylvl", (), greylevels)["matgl"]
+        with recorder.stage("colourgrouping"):
+            return {"matq": image_processing.colourgrouping(matgl, ngl)}
+
+    def labelled():
+        matq = cache.stage(imagekey, "colourgrouping", (ngl, ),
+                           quantized)["matq"]
+        with recorder.stage("label_regions"):
+            labels, stats = image_processing.label_regions(matq, matrgb)
+        if min_area > 1:
+            with recorder.stage("merge_small_regions"):
+                labels, stats = image_processing.merge_small_regions(
+                    labels, stats, matrgb, min_area)
+        return dict(stats, labels=labels)
+
+    def contoured():
+        stats = dict(cache.stage(imagekey, "label_regions", (ngl, min_area),
+                                 labelled))
+        labels = stats.pop("labels")
+        recorder.count("regions", len(stats["area"]))
+        with recorder.stage("detection_contour"):
+            contlist = [image_processing.detection_contour(
+                labels, stats, label, holes=holes)
+                        for label in range(len(stats["area"]))]
+            image_processing.ordercontlist(contlist)
+        return pack_contours(contlist)
+
+    return unpack_contours(cache.stage(
+        imagekey, "detection_contour", (ngl, min_area, holes), contoured))
@@ -3,123 +3,189 @@
 Processing of control points, called waypoints and tangents. From contours to
 Bezier curves
 """
+import collections
+import concurrent.futures
+import itertools
+import time
 import numpy as np
 from numpy.linalg import norm
 import image_elements
+import instrument
+
+CHUNKS_PER_JOB = 4  # Balances the load of workers in curvematcs
+STREAM_CHUNK = 1 << 16  # Pixels of a chunk of streamed contours
+FIRST_CHUNK = 1 << 10  # Pixels of the first one, chunks doubling up to it
+FIT_ITERATIONS = 4  # Least squares fits of a run of pixels before a split
 
 
 def clockwise(p1, p2, p3):
     """Renvoie True si la rotation pour aller du vecteur p2p1 p3p1 se fait en
-    sens horaire (par calcul du déterminant)"""
-    p1p2 = (p2.x - p1.x, p2.y - p1.y)
-    p1p3 = (p3.x - p1.x, p3.y - p1.y)
+    sens horaire (par calcul du déterminant)
+    p1, p2, p3 -- coordinates (x, y) of pixels"""
+    p1p2 = (p2[0] - p1[0], p2[1] - p1[1])
+    p1p3 = (p3[0] - p1[0], p3[1] - p1[1])
     return p1p2[0] * p1p3[1] - p1p2[1] * p1p3[0] < 0
 
 
 def vertan(points):
     """ Teste si la projection sur l'axe x des vecteurs {p2-p1, p3-p1, p4-p1}
     présente un maximum, i.e. si la tangente à la courbe passe à la verticale.
-    points -- list of four image_elements.Pixel() objects
+    points -- (4, 2) array of coordinates of pixels
     returns -- True s'il y a un extremum
     """
     assert len(points) == 4
     projx = [None for _ in range(3)]
     for i in range(3):
-        projx[i] = abs(points[i + 1].x - points[0].x)
+        projx[i] = abs(points[i + 1][0] - points[0][0])
     return projx[1] > projx[0] and projx[1] > projx[2]
     # Stricte ou large? Stricte: passage ponctuel, large direction constante
     # sur un intervalle.
 
 
 def contloop(cont, start, stop):
-    """Returns a slice of the contour cont. If stop > len(cont), the slice
-    goes back to the beginning."""
+    """Returns a slice of the coordinates of contour cont. If
+    stop > len(cont), the slice goes back to the beginning."""
     length = len(cont.xys)
     if stop <= length:
         return cont.xys[start:stop]
     else:
-        return cont.xys[start:stop] + cont.xys[0:stop - length]
+        return np.concatenate((cont.xys[start:stop],
+                               cont.xys[0:stop - length]))
+
+
+def orientations(contour):
+    """Computes along the whole contour the orientations tested by nextop.
+    contour -- image_elements.Contour() object
+    returns -- (sens, turns), boolean arrays such that
+        sens[j] = clockwise(j, j + 1, j + 2) and
+        turns[j] = clockwise(j, j + factor, j + 2 * factor), indices of the
+        latter being taken modulo the last index of the contour as in nextop
+    """
+    cxys = contour.xys.astype(np.int64)
+    length = len(cxys)
+    n = max(length - 1, 1)
+    factor = length // 150
+    indices = np.arange(length)
+
+    def clockwises(inds2, inds3):
+        """clockwise for all pixels of the contour"""
+        p1p2 = cxys[inds2] - cxys
+        p1p3 = cxys[inds3] - cxys
+        return p1p2[:, 0] * p1p3[:, 1] - p1p2[:, 1] * p1p3[:, 0] < 0
 
+    sens = clockwises((indices + 1) % length, (indices + 2) % length)
+    turns = clockwises((indices + factor) % n, (indices + 2 * factor) % n)
+    return sens, turns
 
-def nextop(contour, start, linedges=set()):
-    """Renvoie le pixel correspondant au point de controle d arrivee
-    de la portion de contour partant du pixel start:
+
+def nextop(contour, start_index, linedges, orients=None):
+    """Renvoie l'indice du pixel correspondant au point de controle d arrivee
+    de la portion de contour partant du pixel start_index:
     soit le premier point d'inflexion rencontre, soit le dernier point
     du contour.
-    NB (+2, +1 dernière ligne): le pixel à renvoyer est celui sur lequel a
-        été fait le dernier test, d'où les ajouts. +2 pour la tangente car
-        test sur 4 pixels, on prend celui du milieu.
+    La portion est parcourue par blocs de taille croissante, sur lesquels
+    les conditions d'arrêt sont évaluées d'un coup. Pour le pixel j du
+    parcours, on s'arrête, par ordre de priorité:
+    0 -- si j est une fin de ligne, on renvoie j;
+    1 -- si j + 3 dépasse le contour, on renvoie le dernier pixel;
+    2 -- si le sens de rotation en j + 1 (sur factor pixels) change par
+        rapport à celui du départ, on renvoie j + 1 + factor;
+    3 -- si la tangente passe à la verticale en j + 3 (projection sur l'axe
+        x depuis le départ maximale), on renvoie la fin de ligne de
+        {j + 1, j + 2} s'il y en a une, j + 3 sinon.
     contour -- image_elements.Contour() object
-    start -- pixel de début, image_elements.Pixel() object
+    start_index -- indice du pixel de début
+    linedges -- boolean array, True for pixels ending lines, see scanlines
+    orients -- orientations(contour), computed if not given
     """
+    if orients is None:
+        orients = orientations(contour)
+    sens, turns = orients
     factor = len(contour.xys) // 150
-    cxys = contour.xys  # Shortcut
-    start_index = cxys.index(start)
-    n = len(cxys) - 1  # dernier indice disponible
+    n = len(contour.xys) - 1  # dernier indice disponible
     # Si dépassement, on renvoie le dernier pixel
     if start_index + 1 > n or start_index + 2 > n:
-        return contour.xys[-1]
-    # Initialisation
-    found = (False, "")
-    sens = clockwise(start, contour.xys[start_index + 1],
-                     contour.xys[start_index + 2])
-    new_sens = sens
-    is_vert = vertan(contloop(contour, start_index, start_index + 4))
-    if is_vert:  # Si tangente directement verticale
-        return cxys[start_index + 2]
-    # 0 for linedges, 1 for trespassing, 2 for clockwise, 3 for vertan
-    while not found[0]:
-        if cxys[start_index] in linedges:
-            found = (True, 0)
-        elif start_index + 3 > n:  # dernier point de contour atteint...
-            found = (True, 1)  # ...sans inflexion
-        start_index += 1  # Préparation de la prochaine boucle
-        is_vert = vertan([start] + \
-            contloop(contour, start_index + 1, start_index + 4))
-        new_sens = clockwise(contour.xys[start_index],
-                             contour.xys[(start_index + 1 * factor) % n],
-                             contour.xys[(start_index + 2 * factor) % n])
-        # and not found[0] avoids changing reason of leaving
-        if new_sens != sens and not found[0]:
-            found = (True, 2)
-        elif is_vert and not found[0]:
-            found = (True, 3)
-    if found[1] == 0:
-        return cxys[start_index - 1]  # Previous point
-    elif found[1] == 1:
-        return cxys[-1]
-    elif found[1] == 3:  # Vérifie s'il y a une fin de ligne avant
-        contemp = set(cxys[start_index - 1:start_index + 2]) & linedges
-        if len(contemp) > 0:  # i.e. there is a linedge
-            return contemp.pop()
-        else:
-            return cxys[start_index + 2] if is_vert else cxys[start_index + 1]
-    elif found[1] == 2:
-        if start_index + factor >= n:
-            return cxys[-1]
-        else:
-            return cxys[start_index + factor]
+        return n
+    if vertan(contloop(contour, start_index, start_index + 4)):
+        return start_index + 2  # Si tangente directement verticale
+    xs = contour.xys[:, 0].astype(np.int64)
+    xs = np.concatenate((xs, xs[:4])) - xs[start_index]  # Loops
+    width = 16
+    begin = start_index
+    while True:
+        end = min(begin + width, n - 1)  # Last j tested is n - 2
+        js = np.arange(begin, end)
+        projx = np.abs(xs[begin + 2:end + 4])
+        verts = (projx[1:-1] > projx[:-2]) & (projx[1:-1] > projx[2:])
+        turned = turns[begin + 1:end + 1] != sens[start_index]
+        stops = linedges[begin:end] | turned | verts | (js + 3 > n)
+        if stops.any():
+            j = js[np.argmax(stops)]
+            break
+        begin = end
+        width *= 2
+    if linedges[j]:
+        return j
+    elif j + 3 > n:  # dernier point de contour atteint sans inflexion
+        return n
+    elif turns[j + 1] != sens[start_index]:
+        return n if j + 1 + factor >= n else j + 1 + factor
+    else:  # Vérifie s'il y a une fin de ligne avant
+        contemp = np.flatnonzero(linedges[j + 1:j + 3])
+        return j + 1 + contemp[0] if len(contemp) > 0 else j + 3
 
 
-def list_waypoints(contour):
-    """Creates list of fly over waypoints. Waypoints are given by nextop,
-    and one waypoint is added between the two (middle)
+def waypoint_indices(contour):
+    """Returns the array of the indices of the fly over waypoints given by
+    nextop, from the one following the first pixel to the last pixel
     contour -- Contour()
     """
-    start = contour.xys[0]
-    waypoints = [image_elements.Waypoint(start)]
     linedges = contour.scanlines()
-    while start != contour.xys[-1]:
-        currentindex = contour.xys.index(start)
-        start = nextop(contour, start, linedges=linedges)
-        linedges.discard(start)  # Avoids looping infinitely
-        newindex = contour.xys.index(start)
-        interwaypt = image_elements.Waypoint(
-            contour.xys[(currentindex + newindex) // 2])
-        waypoints.append(interwaypt)
-        waypoints.append(image_elements.Waypoint(start))
-    waypoints[-1] = image_elements.Waypoint(contour.xys[0])
-    return waypoints
+    orients = orientations(contour)
+    last = len(contour.xys) - 1
+    indices = []
+    start = 0
+    while start != last:
+        start = nextop(contour, start, linedges, orients)
+        linedges[start] = False  # Avoids looping infinitely
+        indices.append(start)
+    return np.array(indices, dtype=np.int64)
+
+
+def list_waypoint_indices(contour):
+    """Returns the indices of the fly over waypoints given by nextop, with
+    one waypoint added between two of them (middle), beginning and ending
+    with the first pixel
+    contour -- Contour()
+    """
+    flyovers = waypoint_indices(contour)
+    middles = (np.concatenate(((0, ), flyovers[:-1])) + flyovers) // 2
+    indices = np.empty(2 * len(flyovers) + 1, dtype=np.int64)
+    indices[0] = 0
+    indices[1::2] = middles
+    indices[2::2] = flyovers
+    indices[-1] = 0
+    return indices
+
+
+def list_waypoints(contour):
+    """Creates list of fly over waypoints, see list_waypoint_indices
+    contour -- Contour()
+    """
+    return [image_elements.Waypoint(contour, index)
+            for index in list_waypoint_indices(contour).tolist()]
+
+
+def waypoint_tangents(contour, indices):
+    """Tangents of waypoints of indices indices, precision being the distance
+    to the closest of the neighbouring waypoints (at least 3)
+    returns -- see image_elements.tangents
+    """
+    distances = dists(contour, np.roll(indices, 1), indices)
+    distanceb = np.maximum(distances, 3)
+    distancea = np.roll(distanceb, -1)
+    precisions = np.minimum(distancea, distanceb)
+    return image_elements.tangents(contour.xys, indices, precisions)
 
 
 def usecub(start, end):
@@ -135,26 +201,267 @@ def usecub(start, end):
     return startctl, endctl
 
 
-def curves(contour):
+def usecubs(points, paratans):
+    """Same as usecub for all the curves of a polybezier at once, writes the
+    control matrix (see curves2curvematc) directly
+    points -- (m + 1, 2) array, fly over waypoints
+    paratans -- (m + 1, 2) array, normalised tangents at points
+    returns -- (3 m + 1, 2) array of control points
+    """
+    starts, ends = points[:-1], points[1:]
+    bagheeras = 4e-1 * image_elements.norms(ends - starts)[:, np.newaxis]
+    curvemat = np.empty((3 * len(starts) + 1, 2))
+    curvemat[0] = points[0]
+    curvemat[3::3] = ends
+    for ctls, origins, targets, tans in (
+            (curvemat[1::3], starts, ends, paratans[:-1]),
+            (curvemat[2::3], ends, starts, paratans[1:])):
+        plus = origins + bagheeras * tans
+        minus = origins - bagheeras * tans
+        # Keeps plus unless minus is strictly closer, as min does
+        closer = image_elements.norms(minus - targets) < \
+            image_elements.norms(plus - targets)
+        ctls[:] = np.where(closer[:, np.newaxis], minus, plus)
+    return curvemat
+
+
+def simplified_waypoint_indices(contour, tolerance):
+    """Same as list_waypoint_indices, fly over waypoints being the pixels
+    kept by contour.simplify(tolerance), without middles
+    """
+    return np.append(contour.simplify(tolerance), 0)
+
+
+def bernstein(params):
+    """(m, 4) array of the cubic Bernstein polynomials at params, the points
+    of a cubic curve at params being bernstein(params) @ ctrl"""
+    t = params[:, np.newaxis]
+    return np.hstack(((1 - t) ** 3, 3 * (1 - t) ** 2 * t,
+                      3 * (1 - t) * t ** 2, t ** 3))
+
+
+def fit_cubic(points, basis, tanstart, tanend):
+    """Least squares cubic curve from points[0] to points[-1], whose control
+    points lie on the tangents at both ends (Schneider, Graphics Gems, 1990)
+    points -- (m, 2) array
+    basis -- bernstein of the parameters of the points on the curve
+    tanstart, tanend -- normalised tangents, going along the curve at its
+        start and back into it at its end
+    returns -- (4, 2) array of control points
+    """
+    start, end = points[0], points[-1]
+    along1 = basis[:, 1:2] * tanstart
+    along2 = basis[:, 2:3] * tanend
+    rest = points - (basis[:, 0:1] + basis[:, 1:2]) * start - \
+        (basis[:, 2:3] + basis[:, 3:4]) * end
+    c11, c12, c22 = np.vdot(along1, along1), np.vdot(along1, along2), \
+        np.vdot(along2, along2)
+    x1, x2 = np.vdot(along1, rest), np.vdot(along2, rest)
+    det = c11 * c22 - c12 * c12
+    chord = norm(end - start)
+    alpha1 = alpha2 = chord / 3
+    if abs(det) > 1e-12:
+        alpha1, alpha2 = (x1 * c22 - x2 * c12) / det, \
+            (c11 * x2 - c12 * x1) / det
+    # Least squares are meaningless, e.g. for a few pixels, if a control
+    # point is behind its end or if they cross along the chord
+    if alpha1 < 1e-6 * chord or alpha2 < 1e-6 * chord or \
+            np.dot(alpha1 * tanstart - alpha2 * tanend, end - start) > \
+            chord * chord:
+        alpha1 = alpha2 = chord / 3
+    return np.array((start, start + alpha1 * tanstart,
+                     end + alpha2 * tanend, end))
+
+
+def reparameterise(ctrl, points, params, curve):
+    """One Newton step towards the parameters of the points of the curve of
+    ctrl closest to points
+    curve -- points of the curve at params
+    """
+    diffs = curve - points
+    firsts = 3 * np.diff(ctrl, axis=0)
+    seconds = 2 * np.diff(firsts, axis=0)
+    t = params[:, np.newaxis]
+    prime = (1 - t) ** 2 * firsts[0] + 2 * (1 - t) * t * firsts[1] + \
+        t ** 2 * firsts[2]
+    second = (1 - t) * seconds[0] + t * seconds[1]
+    numerators = (diffs * prime).sum(axis=1)
+    denominators = (prime * prime).sum(axis=1) + (diffs * second).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        steps = np.where(np.abs(denominators) > 1e-12,
+                         numerators / denominators, 0.)
+    return np.clip(params - steps, 0, 1)
+
+
+def fit_contour(contour, max_error):
+    """Creates the control matrix of the fewest cubic Bezier curves within
+    max_error pixels of the pixels of contour: a run of pixels is fitted by
+    least squares (see fit_cubic), reparameterised at most FIT_ITERATIONS
+    times if it is close, and split at its farthest pixel while it is
+    farther than max_error. The contour is first cut at its first pixel and
+    the one farthest from it, tangents at cuts being computed as in
+    waypoint_tangents.
+    contour -- Contour()
+    returns -- control matrix, see curves2curvematc
+    """
+    xys = contour.xys
+    n = len(xys)
+    closed = np.vstack((xys, xys[:1])).astype(float)
+    if n < 3:  # Straight curves back and forth
+        return np.repeat(closed, [3] * n + [1], axis=0)
+
+    far = max(int(np.argmax(image_elements.norms(xys - xys[0]))), 1)
+    precision = max(min(far, n - far), 3)  # See waypoint_tangents
+    (firsttan, fartan), _ = image_elements.tangents(xys, [0, far],
+                                                    [precision, precision])
+    ctrls = []
+    pending = [(far, n, fartan, firsttan), (0, far, firsttan, fartan)]
+    while pending:
+        start, end, tanstart, tanend = pending.pop()
+        points = closed[start:end + 1]
+        lengths = np.concatenate(((0, ), np.cumsum(
+            image_elements.norms(np.diff(points, axis=0)))))
+        params = lengths / lengths[-1]
+        for _ in range(FIT_ITERATIONS):
+            basis = bernstein(params)
+            ctrl = fit_cubic(points, basis, tanstart, -tanend)
+            curve = basis @ ctrl
+            errors = image_elements.norms(curve - points)
+            worst = int(np.argmax(errors[1:-1])) + 1 if len(points) > 2 \
+                else 0
+            if errors[worst] <= max_error or errors[worst] > 4 * max_error:
+                break  # Fitted, or to be split
+            params = reparameterise(ctrl, points, params, curve)
+        if errors[worst] <= max_error or end - start < 2:  # Two pixels
+            ctrls.append(ctrl)
+            continue
+        split = start + worst  # Strictly inside the run, which shrinks
+        tansplit = image_elements.tangents(
+            xys, [split], [max(min(worst, end - split), 3)])[0][0]
+        pending.append((split, end, tansplit, tanend))
+        pending.append((start, split, tanstart, tansplit))
+    instrument.RECORDER.count("curves fitted", len(ctrls))
+    return curves2curvematc(ctrls)
+
+
+def curvematc(contour, tolerance=None, max_error=None):
+    """Creates the control matrix of the cubic Bezier curves of contour,
+    see curves2curvematc
+    contour -- Contour()
+    tolerance -- if given, waypoints are the vertices of the polygon
+        simplifying the contour within tolerance pixels, see
+        simplified_waypoint_indices, instead of the ones of nextop
+    max_error -- if given, curves are fitted by least squares within
+        max_error pixels of the contour, see fit_contour, tolerance being
+        ignored
+    """
+    if max_error is not None:
+        return fit_contour(contour, max_error)
+    if tolerance is None:
+        indices = list_waypoint_indices(contour)
+    else:
+        indices = simplified_waypoint_indices(contour, tolerance)
+    paratans, _ = waypoint_tangents(contour, indices)
+    return usecubs(contour.xys[indices].astype(float), paratans)
+
+
+def timed_curvematc(contour, tolerance=None, max_error=None):
+    """Returns (curvematc(contour, tolerance, max_error), seconds it took)"""
+    start = time.perf_counter()
+    curvemat = curvematc(contour, tolerance, max_error)
+    return curvemat, time.perf_counter() - start
+
+
+def curvematc_chunk(xyslist, tolerance=None, max_error=None):
+    """timed_curvematc of each contour given by its coordinates, in a worker
+    xyslist -- list of (n, 2) arrays, see image_elements.Contour
+    """
+    return [timed_curvematc(image_elements.Contour(xys), tolerance,
+                            max_error)
+            for xys in xyslist]
+
+
+def recorded(fits):
+    """Yields the control matrices of fits, (curvemat, seconds) pairs, after
+    reporting fit time and number of waypoints to instrument.RECORDER"""
+    recorder = instrument.RECORDER
+    for curvemat, seconds in fits:
+        recorder.observe("fit seconds", seconds)
+        recorder.observe("waypoints per contour", (len(curvemat) - 1) // 3)
+        yield curvemat
+
+
+def curvematcs(contours, jobs=1, tolerance=None, max_error=None):
+    """Yields curvematc(contour, tolerance, max_error) for each contour, in
+    order. With several jobs, contours are sent to a pool of processes as
+    coordinate arrays, in chunks of about the same number of pixels.
+    contours -- list of Contour(), or iterator, see curvematcs_stream
+    jobs -- int, number of processes
+    """
+    if jobs <= 1:
+        yield from recorded(timed_curvematc(contour, tolerance, max_error)
+                            for contour in contours)
+        return
+    if not hasattr(contours, "__len__"):
+        yield from curvematcs_stream(contours, jobs, tolerance=tolerance,
+                                     max_error=max_error)
+        return
+    chunks = [[]]
+    target = sum(len(contour) for contour in contours) / \
+        (jobs * CHUNKS_PER_JOB)
+    size = 0
+    for contour in contours:
+        if size >= target:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(contour.xys)
+        size += len(contour)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for result in pool.map(curvematc_chunk, chunks,
+                               itertools.repeat(tolerance),
+                               itertools.repeat(max_error)):
+            yield from recorded(result)
+
+
+def curvematcs_stream(contours, jobs, chunk=STREAM_CHUNK, tolerance=None,
+                      max_error=None):
+    """Same as curvematcs with several jobs for an iterator of contours,
+    which is read as results are consumed: contours are sent by chunks
+    growing from FIRST_CHUNK to about chunk pixels, at most CHUNKS_PER_JOB
+    chunks per job being pending, and results are yielded as soon as the
+    ones before them are
+    """
+    pending = collections.deque()
+    xyslist, size = [], 0
+    target = min(FIRST_CHUNK, chunk)  # Small chunks first, for early results
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for contour in contours:
+            xyslist.append(contour.xys)
+            size += len(contour)
+            if size >= target:
+                pending.append(pool.submit(curvematc_chunk, xyslist,
+                                            tolerance, max_error))
+                xyslist, size = [], 0
+                target = min(2 * target, chunk)
+                if len(pending) >= jobs * CHUNKS_PER_JOB:
+                    yield from recorded(pending.popleft().result())
+            while pending and pending[0].done():  # Results as soon as ready
+                yield from recorded(pending.popleft().result())
+        if xyslist:
+            pending.append(pool.submit(curvematc_chunk, xyslist,
+                                       tolerance, max_error))
+        while pending:
+            yield from recorded(pending.popleft().result())
+
+
+def curves(contour, tolerance=None, max_error=None):
     """Creates Bezier curves for contour
     contour -- Contour()
+    tolerance, max_error -- see curvematc
+    returns -- list of (4, 2) arrays, views on curvematc(contour)
     """
-    curves = []
-    waypoints = list_waypoints(contour)
-    n = len(waypoints)
-    for i in range(n):  # Waypoint by waypoint
-        before, after = waypoints[i - 1], waypoints[(i + 1) % n]
-        distanceb = max(dist(contour, before, waypoints[i]), 3)
-        distancea = max(dist(contour, waypoints[i], after), 3)
-        precision = min(distancea, distanceb)
-        waypoints[i].computan(contour, precision)
-    for i in range(n - 1):
-        start, end = waypoints[i], waypoints[i + 1]
-        middle_s, middle_e = usecub(start, end)
-        curves.append(
-            np.array([[start.x, start.y], [middle_s[0], middle_s[1]],
-                      [middle_e[0], middle_e[1]], [end.x, end.y]]))
-    return curves
+    curvemat = curvematc(contour, tolerance, max_error)
+    return [curvemat[i:i + 4] for i in range(0, len(curvemat) - 1, 3)]
 
 
 def validate_flyby(ctrlpt, wayptb, waypta):
@@ -168,18 +475,24 @@ def validate_flyby(ctrlpt, wayptb, waypta):
     return minx <= ctrlpt[0] <= maxx and miny <= ctrlpt[1] <= maxy
 
 
-def dist(cont, pix1, pix2):
-    """Returns the number of pixels between pix1 and pix2 in contour cont
-    cont -- image_elements.Contour(), with cont.xys a list, therefore ordered
-    pix{1,2} -- image_elements.Pixel()
+def dist(cont, ind1, ind2):
+    """Returns the number of pixels between pixels of indices ind1 and ind2
+    in contour cont
+    cont -- image_elements.Contour()
+    ind{1,2} -- int, positions in cont.xys
     """
-    assert isinstance(cont.xys, list)
-    lind = min(cont.xys.index(pix1), cont.xys.index(pix2))
-    gind = max(cont.xys.index(pix1), cont.xys.index(pix2))
+    lind = min(ind1, ind2)
+    gind = max(ind1, ind2)
     length = len(cont.xys)
     return min(gind - lind, length - gind + lind)
 
 
+def dists(cont, inds1, inds2):
+    """Same as dist for arrays of indices"""
+    gap = np.abs(inds1 - inds2)
+    return np.minimum(gap, len(cont.xys) - gap)
+
+
 def curves2curvemat(curves):
     """Converts a list of curves to a single array of control points. In
     addition it removes redondant points, which are the first point of each
@@ -1,16 +1,24 @@
 # -*- coding: utf-8 -*-
 """Defines graphical elements which will be used in the program"""
+import numpy as np
 from numpy import array
-from numpy.linalg import norm
+
+CHUNK_SIZE = 1 << 20  # Terms summed at once by tangents
+MAX_PRECISION = 1075  # 2**-1075 is 0 in double precision
 
 
 class Waypoint(object):
     """Points over which the Bezier curve will pass"""
+    __slots__ = ("x", "y", "index", "arr", "slope", "paratan")
 
-    def __init__(self, pix):
-        self.x = pix.x
-        self.y = pix.y
-        self.arr = array((pix.x, pix.y))
+    def __init__(self, contour, index):
+        """
+        contour -- Contour() on which the waypoint is
+        index -- int, position of the waypoint in contour.xys
+        """
+        self.x, self.y = contour.xys[index].tolist()
+        self.index = index
+        self.arr = array((self.x, self.y))
         self.slope = None
         self.paratan = None
 
@@ -18,57 +26,101 @@ class Waypoint(object):
         return "<Waypoint at {}, {}>".format(self.x, self.y)
 
     def computan(self, contour, precision):
-        """Computes tangent to contour for waypoint"""
-
-        def paratan2slope(delta_xy):
-            """Pente associée à la tangente paramétrée par delta_x, delta_y
-            delta_xy -- itérable à deux éléments, delta_x en 0 et delta_y
-            en 1"""
-            assert len(delta_xy) == 2
-            if abs(delta_xy[0]) <= 1e-15:
-                return "inf"
-            elif abs(delta_xy[1]) <= 1e-15:
-                return 0
-            else:
-                return delta_xy[1] / delta_xy[0]
-
-        def weight(dist):
-            """Gives weight to pixel while processing tangent.
-            Weight depends on the distance between the hook and the point
-            dist -- integer, distance between hook and pixel"""
-            return 2**(-abs(dist))
-
-        index = contour.xys.index(self)
-        n = len(contour.xys)
-        delta_x_mean = 0
-        delta_y_mean = 0
-        beforeweight = [weight(i) for i in range(1, precision + 1)]
-        afterweight = [weight(i) for i in range(1, precision + 1)]
-        totweight = sum(beforeweight) + sum(afterweight)
-        for i in range(-precision, 0):
-            other_x = contour.xys[(index + i) % n].x
-            other_y = contour.xys[(index + i) % n].y
-            delta_x_mean += (
-                (self.x - other_x) * beforeweight[abs(i) - 1] / totweight)
-            delta_y_mean += (
-                (self.y - other_y) * beforeweight[abs(i) - 1] / totweight)
-        for i in range(1, precision + 1):
-            other_x = contour.xys[(index + i) % n].x
-            other_y = contour.xys[(index + i) % n].y
-            delta_x_mean += (other_x - self.x) * afterweight[i - 1] / totweight
-            delta_y_mean += (other_y - self.y) * afterweight[i - 1] / totweight
-        self.paratan = array((delta_x_mean, delta_y_mean))
-        self.normalise()
-        self.slope = paratan2slope((delta_x_mean, delta_y_mean))
-
-    def normalise(self):
-        """Normalises tangent coefficient (norm of vector self (dx, dy))"""
-        paranorm = norm(self.paratan)
-        self.paratan = (1 / paranorm) * self.paratan
+        """Computes tangent to contour for waypoint, see tangents"""
+        paratans, slopes = tangents(contour.xys, [self.index], [precision])
+        self.paratan = paratans[0]
+        self.slope = slopes[0]
+
+
+def norms(vectors):
+    """Norms of the rows of an (m, 2) array, computed with a dot product as
+    numpy.linalg.norm does, to get the very same values"""
+    squares = np.matmul(vectors[:, np.newaxis], vectors[:, :, np.newaxis])
+    return np.sqrt(squares[:, 0, 0])
+
+
+def tangents(xys, indices, precisions):
+    """Computes at once the tangents to a contour at several waypoints. The
+    tangent at a waypoint is the mean of the vectors going from the precision
+    pixels before it to it, and from it to the precision pixels after it,
+    the weight of a pixel being 2**-|d| for a pixel d pixels away.
+    xys -- (n, 2) array, coordinates of the pixels of the contour
+    indices -- positions of waypoints in xys
+    precisions -- number of pixels taken on each side of each waypoint
+    returns -- (paratans, slopes), (m, 2) array of normalised tangents and
+        array of slopes dy / dx, inf for vertical tangents
+    """
+    xys = np.asarray(xys)
+    indices = np.asarray(indices, dtype=np.int64)
+    precisions = np.asarray(precisions, dtype=np.int64)
+    n = len(xys)
+    m = len(indices)
+    # Weights vanish beyond MAX_PRECISION pixels
+    reach = int(min(precisions.max(initial=1), MAX_PRECISION))
+    dists = np.arange(1, reach + 1)
+    weights = 2.0 ** -dists
+    totweights = 2 * np.cumsum(weights)[np.minimum(precisions, reach) - 1]
+    deltas = np.empty((m, 2))
+    step = max(CHUNK_SIZE // (2 * reach), 1)  # Waypoints at once
+    for k in range(0, m, step):
+        index = indices[k:k + step, np.newaxis]
+        kept = dists <= precisions[k:k + step, np.newaxis]
+        # Terms in the order of summation: far before to near before, near
+        # after to far after, as cumsum adds them one after the other
+        before = xys[index] - xys[(index - dists[::-1]) % n]
+        after = xys[(index + dists) % n] - xys[index]
+        terms = np.concatenate((before * kept[:, ::-1, np.newaxis],
+                                after * kept[:, :, np.newaxis]), axis=1)
+        terms = terms * np.concatenate((weights[::-1], weights))[
+            :, np.newaxis] / totweights[k:k + step, np.newaxis, np.newaxis]
+        deltas[k:k + step] = np.cumsum(terms, axis=1)[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        paratans = (1 / norms(deltas))[:, np.newaxis] * deltas
+        slopes = np.where(np.abs(deltas[:, 1]) <= 1e-15, 0.,
+                          deltas[:, 1] / deltas[:, 0])
+    slopes[np.abs(deltas[:, 0]) <= 1e-15] = np.inf
+    return paratans, slopes
+
+
+def simplify_polyline(points, tolerance, keep=None):
+    """Ramer-Douglas-Peucker simplification of an open polyline, see
+    Contour.simplify
+    points -- (n, 2) float array
+    keep -- boolean array of the points kept from the start, by default the
+        first and last ones, which are always kept
+    returns -- increasing array of the indices of kept points
+    """
+    if keep is None:
+        keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    if len(points) < 3:
+        return np.flatnonzero(keep)
+    while True:
+        kept = np.flatnonzero(keep)
+        parts = np.cumsum(keep)[:-1] - 1  # Part of each point
+        starts = points[kept[parts]]
+        chords = points[kept[parts + 1]] - starts
+        vectors = points[:-1] - starts
+        lengths = norms(chords)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.where(
+                lengths > 0, np.abs(chords[:, 0] * vectors[:, 1] -
+                                    chords[:, 1] * vectors[:, 0]) /
+                lengths, norms(vectors))
+        farthest = np.maximum.reduceat(distances, kept[:-1])
+        # Kept points are excluded so that every round keeps new points
+        split = ((distances > tolerance) & (distances == farthest[parts]) &
+                 ~keep[:-1])
+        if not split.any():
+            return kept
+        # First farthest point of each part
+        _, firsts = np.unique(parts[split], return_index=True)
+        keep[np.flatnonzero(split)[firsts]] = True
 
 
 class Pixel(object):
     """A Pixel of the picture"""
+    __slots__ = ("x", "y")
 
     def __init__(self, x, y):
         self.x = x
@@ -121,20 +173,6 @@ class Pixel(object):
         pixel"""
         return self.x == other.x or self.y == other.y
 
-    def iscorner(self, cont):
-        """Returns whether self is a corner of contour cont
-        cont -- Contour()
-        """
-        clneighbourhood = self.closest_neighbours(cont=cont)
-        if len(clneighbourhood) < 2:
-            return False
-        else:  # At least two closest neighbours
-            neighbour1 = clneighbourhood.pop()
-            neighbour2 = clneighbourhood.pop()
-            cond1 = neighbour1.x == self.x and neighbour2.y == self.y
-            cond2 = neighbour1.y == self.y and neighbour2.x == self.x
-            return cond1 or cond2
-
     def neighbours(self, cont=None):
         """
         A supprimer: quick fix car j'ai besoin des adjacents sans la matread
@@ -173,17 +211,26 @@ class Pixel(object):
 
 
 class Contour(object):
-    """A set or list of pixel circling an area of a same colour"""
+    """Pixels circling an area of a same colour, stored as an (n, 2) int32
+    array of their coordinates"""
 
     def __init__(self, xys):
         """
-        xys -- list or set of pixels
+        xys -- (n, 2) array of coordinates or list of Pixel(), ordered along
+            the contour, each pixel appearing once
         """
-        self.xys = xys
+        if len(xys) > 0 and isinstance(xys[0], Pixel):
+            xys = [(pix.x, pix.y) for pix in xys]
+        self.xys = np.array(xys, dtype=np.int32).reshape((-1, 2))
         self.colour = None
+        self.holes = []  # Contours of holes of the area
+        self.indices = None  # Lazy map from coordinates to position
+
+    def __len__(self):
+        return len(self.xys)
 
     def __eq__(self, other):
-        return self.xys == other.xys
+        return np.array_equal(self.xys, other.xys)
 
     def __lt__(self, other):
         return len(self.xys) < len(other.xys)
@@ -192,119 +239,70 @@ class Contour(object):
         if len(self.xys) == 0:
             return 0
         else:
-            if isinstance(self.xys, list):
-                return int(self.xys[0].x)
-            elif isinstance(self.xys, set):
-                return int(self.xys.copy().pop().x)
-
-    def separate_contour(self, begpix):
-        """Extracts and replaces self.xys by the greater contour in self,
-        ordering and filtering pixels. Filter is made by favouring
-        Xneighbours over close neighbours. loopcount is used to manage inital
-        steps, which is the hardest part of the program.
-        begpix -- Pixel() on which the inspection will start
+            return int(self.xys[0, 0])
+
+    def pixel(self, index):
+        """Returns the Pixel() at position index"""
+        return Pixel(*self.xys[index].tolist())
+
+    def index(self, pix):
+        """Returns the position of pixel pix in the contour, in constant time
+        pix -- Pixel()
         """
-        assert isinstance(self.xys, set)
-
-        def initsteps(pix, initneighbourhood):
-            """Automation of two init steps
-            Two in-place modif: removing pix then anglepix (if it exists)
-            """
-            clneighbourhood = pix.closest_neighbours(cont=self)
-            xneighbourhood = initneighbourhood - clneighbourhood
-            self.xys.remove(pix)
-            if len(xneighbourhood) >= 1:
-                ninspix = xneighbourhood.pop()
-                anglepix = clneighbourhood & ninspix.neighbours(cont=self)
-                self.xys.discard(anglepix)
-            else:
-                ninspix = clneighbourhood.pop()
-            return ninspix
-
-        loop = []  # Ordered, therefore list
-        # Remove if corner
-        if begpix.iscorner(cont=self):
-            self.xys.remove(begpix)
-        # Choosing first pixel
-        begpix = self.xys.copy().pop()
-        while len(begpix.neighbours(cont=self)) < 2:  # If weird pixel...
-            if len(self.xys) <= 2:
-                return None
-            else:
-                self.xys.remove(begpix)
-                begpix = self.xys.copy().pop()
-        loop.append(begpix)
-        # First step
-        tramp = begpix.neighbours(cont=self)
-        if len(tramp) == 0:
-            return None
-        inspix = initsteps(begpix, tramp)
-        loop.append(inspix)
-        # 2nd step
-        neighbourhood = inspix.neighbours(cont=self)
-        if len(neighbourhood) == 0:
-            print("Error")
-            return None
-        inspix = initsteps(inspix, neighbourhood)
-        neighbourhood = inspix.neighbours(cont=self)
-        sparepix = set(neighbourhood)  # Used if KeyError
-        self.xys.remove(inspix)
-        while inspix not in tramp and len(sparepix) > 0:
-            loop.append(inspix)
-            clneighbourhood = neighbourhood & inspix.closest_neighbours()
-            xneighbourhood = neighbourhood - clneighbourhood
-            try:
-                if len(xneighbourhood) > 0:
-                    inspix = xneighbourhood.pop()
-                else:
-                    inspix = clneighbourhood.pop()
-                sparepix.remove(inspix)
-            except KeyError:
-                inspix = sparepix.pop()
-            finally:
-                self.xys.remove(inspix)
-                neighbourhood = inspix.neighbours(cont=self)
-                sparepix.update(neighbourhood)
-        loop.append(inspix)
-        return loop
-
-    def optimseparate(self):
-        """ If several contours are in self (not declared), returns the closest
-        from border"""
-        pix = min(self.xys, key=lambda p: abs(p.x))
-        self.xys = self.separate_contour(pix)
+        if self.indices is None:
+            self.indices = {
+                xy: i for i, xy in enumerate(map(tuple, self.xys.tolist()))}
+        return self.indices[(pix.x, pix.y)]
 
     def scanlines(self):
-        """Looks for straight lines with length greater than 3 pixels.
+        """Looks for straight lines with length greater than 3 pixels, i.e.
+        runs of steps along which a coordinate does not change.
         Fortunately for choordinate, right angles don't exist in our
-        world"""
-        cxys = self.xys[1:]  # Shortcut
-        linedges = set()  # Don't care about order
-        aligned = 0
-        threshold = max(int(len(self.xys) * 0.03), 3)  # Chosen after tests
-        for i, pix in enumerate(cxys):
-            # choordinate stands for change of coordinate (we mean both)...
-            choordinate = not (pix.x == self.xys[i].x or
-                               pix.y == self.xys[i].y)
-            if not choordinate:
-                aligned += 1
-                # If last pixel of contour in a line
-                if pix == cxys[-1] and aligned >= threshold:
-                    for inlinepix in cxys[i - aligned + 1:i]:
-                        linedges.remove(inlinepix)
-                # Particular case
-                elif pix == cxys[-1] and aligned == threshold - 1:
-                    linedges.add(pix)
-                elif aligned == threshold - 1:  # If 3 points are aligned
-                    for k in range(threshold):
-                        linedges.add(cxys[i - k])
-                elif aligned >= threshold:
-                    linedges.add(pix)
-            # Coordinate change after aligned sequence
-            elif aligned >= threshold - 1 and choordinate:
-                for inlinepix in cxys[i - aligned:i - 1]:
-                    linedges.remove(inlinepix)  # Removes line content
-                aligned = 0
-            else:  # Coordinate change without any alignement
-                aligned = 0
+        world. A line of at least threshold - 1 steps gives its two ends,
+        except when it ends the contour: then it only gives its first pixel,
+        or its last one if it has exactly threshold - 1 steps. The first
+        pixel of a line beginning the contour is taken as the last pixel of
+        the contour.
+        returns -- boolean array, True for pixels ending lines"""
+        length = len(self.xys)
+        linedges = np.zeros(length, dtype=bool)
+        threshold = max(int(length * 0.03), 3)  # Chosen after tests
+        # choordinate stands for change of coordinate (we mean both)...
+        steps = np.diff(self.xys, axis=0)
+        aligned = np.concatenate(
+            ((False, ), (steps[:, 0] == 0) | (steps[:, 1] == 0), (False, )))
+        changes = np.flatnonzero(np.diff(aligned.astype(np.int8)))
+        firsts, lasts = changes[::2], changes[1::2] - 1  # Steps of runs
+        if len(firsts) == 0:
+            return linedges
+        nsteps = lasts - firsts + 1
+        begins = np.where(firsts == 0, length - 1, firsts)
+        ends = lasts + 1
+        inside = lasts < length - 2  # Line not ending the contour
+        linedges[begins[inside & (nsteps >= threshold - 1)]] = True
+        linedges[ends[inside & (nsteps >= threshold - 1)]] = True
+        if not inside[-1]:
+            if nsteps[-1] >= threshold:
+                linedges[begins[-1]] = True
+            elif nsteps[-1] == threshold - 1:
+                linedges[ends[-1]] = True
         return linedges
+
+    def simplify(self, tolerance):
+        """Ramer-Douglas-Peucker simplification of the closed contour: the
+        pixel farthest from the chord of a part of the contour is kept if it
+        is more than tolerance pixels away, and splits the part in two. All
+        the parts are split at once, a round at a time, beginning with the
+        first pixel and the one farthest from it.
+        tolerance -- maximal distance in pixels of dropped pixels to the
+            polygon of the kept ones
+        returns -- increasing array of the indices of kept pixels, beginning
+            with 0
+        """
+        length = len(self.xys)
+        if length < 4:
+            return np.arange(length)
+        points = np.concatenate((self.xys, self.xys[:1])).astype(float)
+        keep = np.zeros(length + 1, dtype=bool)
+        keep[[0, np.argmax(norms(points - points[0])), length]] = True
+        return simplify_polyline(points, tolerance, keep)[:-1]
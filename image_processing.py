@@ -3,60 +3,113 @@
 Operations performed on the image, from raw image to contours
 """
 import numpy as np
+import scipy.ndimage
+import scipy.sparse
+import scipy.sparse.csgraph
 import image_elements
+import instrument
 
+LUMA = (0.2126, 0.7152, 0.0722)  # Coefficients found on wikipedia
+CHUNK_SIZE = 1 << 20  # Pixels converted at once by pic2greylvl
+TRACE_BLOCK = 256  # Contours traced at once by contours_stream
+# Moore neighbourhood, clockwise, beginning with the upper neighbour
+MOORE = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
 
-def pic2greylvl(matrgb):
-    """Coefficient found on wikipedia"""
+
+def maxvalue(matrgb):
+    """Value of a fully lit channel for the dtype of matrgb: 65535 for 16 bit
+    pictures, 255 otherwise (floats are expected to be in [0, 255] as well).
+    Wider integers, such as the int32 matrices PIL gives for 16 bit greyscale
+    pictures (mode "I"), are taken as 16 bit values too.
+    """
+    if np.issubdtype(matrgb.dtype, np.integer) and matrgb.dtype.itemsize > 1:
+        return min(np.iinfo(matrgb.dtype).max, 65535)
+    return 255
+
+
+def pic2greylvl(matrgb, dtype=np.float64, chunk=CHUNK_SIZE):
+    """Converts a picture to a greylevels matrix, coefficients in [0, 1].
+    matrgb -- np.array, (rows, cols) greyscale or (rows, cols, channels) with
+        1 (grey), 2 (grey + alpha), 3 (RGB) or 4 (RGBA) channels, alpha is
+        ignored
+    dtype -- dtype of the returned matrix, np.float32 halves memory
+    chunk -- approximate number of pixels converted at once, bounds the size
+        of the temporaries
+    """
+    matrgb = np.asarray(matrgb)
+    if matrgb.ndim == 2:
+        matrgb = matrgb[:, :, np.newaxis]
     (a, b, c) = matrgb.shape
-    matgl = np.zeros(shape=(a, b))  # matrix greylevels
-    for i in range(a):
-        for j in range(b):
-            matgl[i][j] += ((matrgb[i][j][0] / 255) * 0.2126 +
-                            (matrgb[i][j][1] / 255) * 0.7152 +
-                            (matrgb[i][j][2] / 255) * 0.0722)
+    scale = maxvalue(matrgb)
+    matgl = np.empty((a, b), dtype=dtype)  # matrix greylevels
+    step = max(chunk // max(b, 1), 1)  # Rows per chunk
+    for i in range(0, a, step):
+        rows = matrgb[i:i + step]
+        if c < 3:  # Grey, possibly with alpha
+            matgl[i:i + step] = rows[:, :, 0] / scale
+        else:
+            matgl[i:i + step] = ((rows[:, :, 0] / scale) * LUMA[0] +
+                                 (rows[:, :, 1] / scale) * LUMA[1] +
+                                 (rows[:, :, 2] / scale) * LUMA[2])
     return matgl
 
 
-def colourgrouping(matgl, ngl):
+def quantize(matgl, edges, levels, zero, out=None, chunk=CHUNK_SIZE):
+    """Bins matgl in a single pass: values in ]edges[i], edges[i + 1]] are
+    replaced by levels[i], 0s by zero and anything else (out of [0, 1]) by 1.
+    8 and 16 bit matrices are taken as greylevels scaled by maxvalue and go
+    through a lookup table of all their possible values.
+    matgl -- greylevels matrix
+    edges -- increasing np.array of bin edges, edges[0] being 0
+    levels -- np.array of len(edges) - 1 values
+    zero -- value given to 0s
+    out -- matrix, same shape as matgl, in which the result is written
+    returns -- out, float matrix of same dtype as matgl (float64 for integer
+        matrices) if out is not given
+    """
+    if out is None:
+        dtype = matgl.dtype if np.issubdtype(matgl.dtype, np.floating) \
+            else np.float64
+        out = np.empty(matgl.shape, dtype=dtype)
+    if matgl.dtype in (np.uint8, np.uint16):
+        scale = maxvalue(matgl)
+        lut = quantize(np.arange(scale + 1) / scale, edges, levels, zero)
+        return np.take(lut, matgl, out=out)
+    # The extra edge separates 0s from negative values
+    edges = np.concatenate(((-np.nextafter(0, 1), ), edges))
+    lut = np.concatenate(((1, zero), levels, (1, )))
+    step = max(chunk // max(matgl[:1].size, 1), 1)  # Rows per chunk
+    for i in range(0, len(matgl), step):
+        binned = np.searchsorted(edges, matgl[i:i + step], side='left')
+        np.take(lut, binned, out=out[i:i + step])
+    return out
+
+
+def colourgrouping(matgl, ngl, out=None):
     """Limits the number of greylevels in the image. Apply it BEFORE
     adding border.
     matgl -- greylevels matrix, coefficients in [0, 1]
     ngl -- int, number of grey levels to keep
+    out -- matrix in which the result is written, e.g. the inside of a
+        bordered matrix
     """
-    matfilt = np.ones_like(matgl)
     greylevels = np.linspace(0, 1, ngl)
-    cond = np.where(matgl == 0, True, False)
-    matfilt[cond] = 0 * np.ones_like(matgl[cond])
-    for i in range(ngl - 1):
-        mat_condition1 = np.where(matgl > greylevels[i], True, False)
-        mat_condition2 = np.where(matgl <= greylevels[i + 1], True, False)
-        mask = np.logical_and(mat_condition1, mat_condition2)
-        matfilt[mask] = (((greylevels[i] + greylevels[i + 1]) / 2) *
-                         np.ones_like(matgl[mask]))
-    return matfilt
+    middles = (greylevels[:-1] + greylevels[1:]) / 2
+    return quantize(matgl, greylevels, middles, 0, out=out)
 
 
-def regroupement_couleur(matricenb, seuil):
+def regroupement_couleur(matricenb, seuil, out=None):
     """
     regroupe sous formes d'intervalles les couleurs de la matrice
     en noir et blanc. Traitement spécial pour le 0 à cause de la condition
     mat_condidion1
     A appliquer AVANT l'ajout de bordure
     """
-    matfilt = np.ones_like(matricenb)
     couleur = np.arange(0, 1 + seuil, seuil)
+    niveaux = np.minimum((2 * np.arange(len(couleur) - 1) + 1) * seuil / 2, 1)
     # Special treatment for 0s...
-    cond = np.where(matricenb == 0, True, False)
-    matfilt[cond] = (
-        couleur[0] + couleur[1]) / 2 * np.ones_like(matricenb[cond])
-    for i in range(len(couleur[:-1])):
-        mat_condition1 = np.where(matricenb > couleur[i], True, False)
-        mat_condition2 = np.where(matricenb <= couleur[i + 1], True, False)
-        mat = np.logical_and(mat_condition1, mat_condition2)
-        matfilt[mat] = min((2 * i + 1) * seuil / 2,
-                           1) * np.ones_like(matricenb[mat])
-    return matfilt
+    zero = (couleur[0] + couleur[1]) / 2
+    return quantize(matricenb, couleur, niveaux, zero, out=out)
 
 
 def add_border(matng):
@@ -71,113 +124,335 @@ def add_border(matng):
     return matng_border
 
 
-def detection_contour(matrgb, matng, begpix):
-    """Detects a contour circling a zone of a colour, contour is outside the
-    zone of same colour (avoids issues of contours sharing pixels)
-    matng -- greylevel matrix
-    begpix -- pixel on which the recursion is to begin
-    seuil -- could be removed, because of regroupement_couleur
-    """
-    upper = 300
-    matread_loc = np.zeros_like(matng, dtype=bool)
-    # Adding begpix to be sure to launch function (if begpix is alone)
-    notreadneighbours = begpix.closest_neighbours() | set((begpix, ))
-    begcolour = matng[begpix.x, begpix.y]
-    # Removing pixels from another zone from notreadneighbours
-    for neighbour in notreadneighbours.copy():
-        neighcolour = matng[neighbour.x, neighbour.y]
-        if abs(neighcolour - begcolour) > 0:
-            notreadneighbours.remove(neighbour)
-    contour = image_elements.Contour(set())
-
-    def contourec(inspix, notreadneighbours, k=0):
-        """
-        notreadneighbours -- list of pixels which haven't been inspix yet, i.e.
-            a pixel in notreadneighbours may have been compared with an inspix
-            while its neighbours haven't been
-        inspix -- Pixel() inspected, each neighbour's colour is compared with
-            the former's to determine whether inspix is the last pixel of the
-            colour. If so, it will be added to contpart, and then to contour.
-            It is removed from the notreadneighbours when acquired via pop()
-        k -- counter, to avoid MaxRecursionDepth
-        """
-        matread_loc[inspix.x, inspix.y] = True
-        neighbourhood = inspix.closest_adjs(matread_loc)
-        notreadneighbours |= neighbourhood
-        contour_found = False
-        inscolour = matng[inspix.x, inspix.y]
-        contour_part = set()
-        for neighbour in neighbourhood:
-            neighcolour = matng[neighbour.x, neighbour.y]
-            if abs(neighcolour - inscolour) > 0:
-                contour_found = True
-                notreadneighbours.remove(neighbour)
-                contour_part.add(neighbour)
-            # If not other colour, don't read it again. However, its
-            # neighbours will be inspected, as it has been added to
-            # notreadneighbours
-            else:
-                matread_loc[neighbour.x, neighbour.y] = True
-        if contour_found:
-            return contour_part
-        elif k == upper or len(notreadneighbours) == 0:
-            return set((None, ))
-        else:
-            nextinspix = notreadneighbours.pop()
-            return contourec(nextinspix, notreadneighbours, k + 1)
+def label_regions(matq, matrgb):
+    """Labels the zones of same colour (4-connected) of the quantized matrix
+    matq in one pass: pixels are grouped in runs of same colour along rows,
+    then runs of same colour which touch vertically are joined as connected
+    components of a graph.
+    matq -- quantized greylevels matrix, without border
+    matrgb -- picture matq was computed from, gives the colour of zones
+    returns -- (labels, stats) with labels an int32 matrix of the shape of matq
+        giving the zone of each pixel, zones being numbered in the order of
+        their first pixel in a raster scan, and stats a dictionnary of arrays
+        indexed by zone:
+        "area" -- number of pixels
+        "bbox" -- (xmin, ymin, xmax, ymax), bounds included
+        "seed" -- (x, y) of first pixel in raster scan, i.e. upper left pixel
+        "colour" -- mean RGB colour, in [0, 255]
+    """
+    (row, col) = matq.shape
+    starts = np.ones(matq.shape, dtype=bool)  # First pixels of runs
+    starts[:, 1:] = matq[:, 1:] != matq[:, :-1]
+    runs = np.cumsum(starts, dtype=np.int32).reshape(matq.shape) - 1
+    runstarts = np.flatnonzero(starts)
+    nruns = len(runstarts)
+    # A pair of runs needs only be linked once, where one of them begins
+    same = matq[1:] == matq[:-1]
+    link = same & (starts[1:] | starts[:-1])
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(np.count_nonzero(link), dtype=np.int8),
+         (runs[1:][link], runs[:-1][link])), shape=(nruns, nruns))
+    nzones, runzones = scipy.sparse.csgraph.connected_components(
+        graph, directed=False)
+    # Numbering zones by their first run
+    _, firstruns = np.unique(runzones, return_index=True)
+    order = np.argsort(firstruns)
+    renum = np.empty(nzones, dtype=np.int32)
+    renum[order] = np.arange(nzones, dtype=np.int32)
+    runzones = renum[runzones]
+    labels = runzones[runs]
+    # Statistics, computed on runs as much as possible
+    runxs, runys = np.divmod(runstarts, col)
+    runends = (np.append(runstarts[1:], row * col) - 1) % col  # Same row
+    byzone = np.argsort(runzones, kind='stable')
+    firsts = np.searchsorted(runzones[byzone], np.arange(nzones))
+    bbox = np.empty((nzones, 4), dtype=np.int64)
+    bbox[:, 0] = runxs[firstruns[order]]
+    bbox[:, 1] = np.minimum.reduceat(runys[byzone], firsts)
+    bbox[:, 2] = np.maximum.reduceat(runxs[byzone], firsts)
+    bbox[:, 3] = np.maximum.reduceat(runends[byzone], firsts)
+    seed = np.stack((bbox[:, 0], runys[firstruns[order]]), axis=1)
+    area = np.bincount(labels.ravel(), minlength=nzones)
+    colour = colour_sums(labels, matrgb, nzones)
+    colour *= 255 / maxvalue(matrgb) / area[:, np.newaxis]
+    stats = {"area": area, "bbox": bbox, "seed": seed, "colour": colour}
+    return labels, stats
+
+
+def merge_small_regions(labels, stats, matrgb, min_area):
+    """Removes speckles: zones of less than min_area pixels are merged into
+    the neighbouring zone with which they share the longest border (the
+    largest one in case of tie), until none of them is left, save the ones
+    without neighbours. Neighbours are found at once by counting the pairs
+    of zones of adjacent pixels, and chains of small zones are merged as
+    connected components of a graph.
+    labels, stats -- zones, see label_regions
+    matrgb -- picture, gives the colour of merged zones
+    min_area -- minimal number of pixels of a zone
+    returns -- (labels, stats) as label_regions, zones being numbered in the
+        order of their first pixel in a raster scan
+    """
+    while True:
+        area = stats["area"]
+        nzones = len(area)
+        small = area < min_area
+        if not small.any():
+            break
+        zones, neighbours = [], []
+        for (one, other) in ((labels[:, :-1], labels[:, 1:]),
+                             (labels[:-1], labels[1:])):
+            border = one != other
+            one, other = one[border], other[border]
+            zones += [one, other]
+            neighbours += [other, one]
+        zones, neighbours = np.concatenate(zones), np.concatenate(neighbours)
+        kept = small[zones]
+        pairs, lengths = np.unique(
+            zones[kept].astype(np.int64) * nzones + neighbours[kept],
+            return_counts=True)
+        if len(pairs) == 0:  # Small zones without neighbours
+            break
+        zones, neighbours = np.divmod(pairs, nzones)
+        # Last pair of each zone: longest border, then largest neighbour
+        order = np.lexsort((area[neighbours], lengths, zones))
+        zones, neighbours = zones[order], neighbours[order]
+        last = np.append(zones[1:] != zones[:-1], True)
+        target = np.arange(nzones)
+        target[zones[last]] = neighbours[last]
+        graph = scipy.sparse.coo_matrix(
+            (np.ones(nzones, dtype=np.int8), (np.arange(nzones), target)),
+            shape=(nzones, nzones))
+        nmerged, merged = scipy.sparse.csgraph.connected_components(
+            graph, directed=False)
+        # Numbering merged zones by their first zone, i.e. their first pixel
+        _, firstzones = np.unique(merged, return_index=True)
+        order = np.argsort(firstzones)
+        renum = np.empty(nmerged, dtype=np.int32)
+        renum[order] = np.arange(nmerged, dtype=np.int32)
+        merged = renum[merged]
+        firstzones = firstzones[order]
+        instrument.RECORDER.count("speckles merged", nzones - nmerged)
+        labels = merged[labels]
+        byzone = np.argsort(merged, kind='stable')
+        firsts = np.searchsorted(merged[byzone], np.arange(nmerged))
+        bbox = np.empty((nmerged, 4), dtype=np.int64)
+        bbox[:, 0] = stats["bbox"][firstzones, 0]
+        bbox[:, 1] = np.minimum.reduceat(stats["bbox"][byzone, 1], firsts)
+        bbox[:, 2] = np.maximum.reduceat(stats["bbox"][byzone, 2], firsts)
+        bbox[:, 3] = np.maximum.reduceat(stats["bbox"][byzone, 3], firsts)
+        area = np.bincount(merged, weights=area,
+                           minlength=nmerged).astype(np.int64)
+        colour = colour_sums(labels, matrgb, nmerged)
+        colour *= 255 / maxvalue(matrgb) / area[:, np.newaxis]
+        stats = {"area": area, "bbox": bbox, "seed": stats["seed"][firstzones],
+                 "colour": colour}
+    return labels, stats
+
+
+def colour_sums(labels, matrgb, nzones):
+    """Sums of the RGB channels of matrgb over each zone of labels, as
+    (nzones, 3) float array. Greyscale pictures, possibly with alpha, have
+    their grey repeated.
+    """
+    channels = np.asarray(matrgb)
+    if channels.ndim == 2:
+        channels = channels[:, :, np.newaxis]
+    rgb = (0, 1, 2) if channels.shape[2] >= 3 else (0, 0, 0)
+    sums = np.empty((nzones, 3))
+    for k, channel in enumerate(rgb):
+        sums[:, k] = np.bincount(labels.ravel(),
+                                 weights=channels[:, :, channel].ravel(),
+                                 minlength=nzones)
+    return sums
+
+
+def zone_window(labels, bbox, label, margin=1):
+    """Boolean mask of zone label, cut around its bounding box bbox with
+    margin pixels on each side. Pixel (0, 0) of the mask is pixel
+    (xmin - margin, ymin - margin) of labels.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    zone = np.zeros((xmax - xmin + 1 + 2 * margin,
+                     ymax - ymin + 1 + 2 * margin), dtype=bool)
+    zone[margin:margin + xmax - xmin + 1, margin:margin + ymax - ymin + 1] = \
+        labels[xmin:xmax + 1, ymin:ymax + 1] == label
+    return zone
+
+
+def trace_boundary(mask, start):
+    """Moore neighbour tracing of the outer boundary of the component of mask
+    (8-connected) containing start, see trace_flat
+    mask -- boolean matrix
+    start -- (x, y), first pixel of the component in a raster scan
+    """
+    (row, col) = mask.shape
+    width = col + 2  # Padding avoids testing bounds
+    padded = np.zeros((row + 2, width), dtype=np.uint8)
+    padded[1:-1, 1:-1] = mask
+    return trace_flat(padded.tobytes(), width, start)
+
+
+def trace_flat(flat, width, start):
+    """Moore neighbour tracing of the outer boundary of the component
+    (8-connected) containing start of a mask given as a flat sequence. Walks
+    once around the component, each pixel of the boundary having a closest
+    neighbour outside of the mask.
+    flat -- anything whose item (x + 1) * width + y + 1 tells whether pixel
+        (x, y) is in the mask, e.g. the bytes of the mask padded with a
+        frame of 0s, which must be as well in flat
+    width -- number of columns of the padded mask
+    start -- (x, y), first pixel of the component in a raster scan
+    returns -- (n, 2) int array of pixels, each one being a neighbour of the
+        previous one, the last one a neighbour of the first. Pixels of one
+        pixel wide parts of the component appear several times.
+    """
+    offsets = [dx * width + dy for (dx, dy) in MOORE]
+    begin = (start[0] + 1) * width + start[1] + 1
+    # Direction of the pixel examined before the one moved to, seen from the
+    # latter
+    backwards = [(d - 2) % 8 if d % 2 == 0 else (d + 5) % 8 for d in range(8)]
+    path = []
+    pos, back = begin, 6  # Left neighbour of start is outside, raster scan
+    second = None
+    while True:
+        for k in range(1, 9):
+            direction = (back + k) % 8
+            if flat[pos + offsets[direction]]:
+                break
+        else:  # Isolated pixel
+            path.append(pos)
+            break
+        nextpos = pos + offsets[direction]
+        # Jacob's stopping criterion: leaving start the same way again
+        if pos == begin:
+            if second is None:
+                second = nextpos
+            elif nextpos == second:
+                break
+        path.append(pos)
+        back = backwards[direction]
+        pos = nextpos
+    xs, ys = np.divmod(np.array(path), width)
+    return np.stack((xs - 1, ys - 1), axis=1)
+
+
+def detection_contour(labels, stats, label, holes=False):
+    """Detects the contour circling zone label, contour is outside the
+    zone of same colour (avoids issues of contours sharing pixels). Pixels of
+    the contour are given in the coordinates of the bordered matrix (see
+    add_border), so that they are never negative, and ordered along the
+    boundary, each one appearing once.
+    labels, stats -- zones of the picture, see label_regions
+    label -- int, zone whose contour is to be found
+    holes -- whether contours of the holes of the zone are to be found as
+        well, they are then stored in contour.holes, also outside the zone
+    """
+    xmin, ymin = stats["bbox"][label][:2]
+    zone = zone_window(labels, stats["bbox"][label], label)
+    around = zone.copy()  # Zone and its closest neighbours
+    around[1:] |= zone[:-1]
+    around[:-1] |= zone[1:]
+    around[:, 1:] |= zone[:, :-1]
+    around[:, :-1] |= zone[:, 1:]
+    # Boundary of around only has pixels outside the zone. Its first pixel is
+    # above the seed, on the first row of the window.
+    begin = (0, stats["seed"][label][1] - ymin + 1)
+    path = trace_boundary(around, begin)
+    instrument.RECORDER.count("pixels traced", len(path))
+    # Margin and border compensate each other
+    contour = image_elements.Contour(firstoccurrences(path + (xmin, ymin)))
+    instrument.RECORDER.count("contour points", len(contour))
+    contour.colour = vec2hex(stats["colour"][label])
+    if holes:
+        # Components of the outside of the zone not touching the window edge
+        outside, _ = scipy.ndimage.label(~zone, structure=np.ones((3, 3)))
+        edge = np.unique(np.concatenate(
+            ((0, ), outside[0], outside[-1], outside[:, 0], outside[:, -1])))
+        for hole in np.setdiff1d(np.unique(outside), edge):
+            hole = outside == hole
+            begin = np.unravel_index(np.argmax(hole), hole.shape)
+            contour.holes.append(image_elements.Contour(
+                firstoccurrences(trace_boundary(hole, begin) + (xmin, ymin))))
+    return contour
 
-    while len(notreadneighbours) > 0:
-        begpix = notreadneighbours.pop()
-        contour.xys |= contourec(begpix, notreadneighbours)
-    contour.xys.discard(None)
-    # Setting colour
-    truecoords = np.where(matread_loc)
-    coord = truecoords[0][0], truecoords[1][0]
-    colour = matrgb[coord[0] - 1, coord[1] - 1, :]
-    contour.colour = vec2hex(colour)
-    return contour, matread_loc
+
+def firstoccurrences(path):
+    """Removes from an (n, 2) array of pixels given by trace_boundary the
+    pixels which already appeared"""
+    _, firsts = np.unique(path, axis=0, return_index=True)
+    return path[np.sort(firsts)]
 
 
 def clamp(x):
     return max(0, min(x, 255))
 
 
-def vec2hex(colour_contour):
+def vec2hex(colour_contour, scale=255):
     """
     Converts RGB colour to a 6 digit code
     corresponding to the hexadecimal form
+    colour_contour -- RGB(A) vector, or grey (+ alpha) value(s)
+    scale -- value of a fully lit channel, see maxvalue
     """
-    r = colour_contour[0]
-    g = colour_contour[1]
-    b = colour_contour[2]
+    colour = np.atleast_1d(colour_contour)
+    if len(colour) < 3:  # Greyscale
+        colour = colour[:1].repeat(3)
+    r, g, b = (int(round(float(c) * 255 / scale)) for c in colour[:3])
     return "#{0:02x}{1:02x}{2:02x}".format(clamp(r), clamp(g), clamp(b))
 
 
-def contours_image(matrgb, ngl=8):
-    """
-    Donne l'ensemble des contours de la matrice en niveaux de gris avec
-    bordure matngb.
-    matngb -- np.array, greyscale matrix, with added border
+def zones_image(matrgb, ngl=8, min_area=1):
+    """Labels and stats of the zones of the picture, see label_regions
+    matrgb -- np.array, picture
     ngl -- number of greylevels to keep in final image
+    min_area -- zones of less pixels are merged into a neighbour, see
+        merge_small_regions
+    """
+    recorder = instrument.RECORDER
+    with recorder.stage("pic2greylvl"):
+        matgl = pic2greylvl(matrgb)
+    with recorder.stage("colourgrouping"):
+        matgl = colourgrouping(matgl, ngl)
+    with recorder.stage("label_regions"):
+        labels, stats = label_regions(matgl, matrgb)
+    if min_area > 1:
+        with recorder.stage("merge_small_regions"):
+            labels, stats = merge_small_regions(labels, stats, matrgb,
+                                                min_area)
+    recorder.count("regions", len(stats["area"]))
+    return labels, stats
+
+
+def contours_image(matrgb, ngl=8, holes=False, min_area=1):
+    """
+    Donne la liste des contours de l'image, un par zone de même niveau de
+    gris, dans l'ordre de label_regions.
+    matrgb -- np.array, picture
+    ngl, min_area -- see zones_image
+    holes -- whether contours of holes are computed, see detection_contour
+    """
+    labels, stats = zones_image(matrgb, ngl, min_area)
+    with instrument.RECORDER.stage("detection_contour"):
+        return [detection_contour(labels, stats, label, holes=holes)
+                for label in range(len(stats["area"]))]
+
+
+def contours_stream(matrgb, ngl=8, holes=False, min_area=1):
+    """Yields the contours of contours_image, each one being traced when it
+    is asked for. Zones are numbered in the order of their first pixel, so
+    contours already come in the order of ordercontlist. They are traced by
+    blocks of TRACE_BLOCK, each one timed as a detection_contour stage.
     """
-    matngb = pic2greylvl(matrgb)
-    matngb = colourgrouping(matngb, ngl)
-    matngb = add_border(matngb)
-    contset = set()
-    matread = np.zeros_like(matngb, dtype=bool)
-    while False in matread[1:-1, 1:-1]:
-        # Finds false in matread without border
-        notread = np.where(matread[1:-1, 1:-1] == False)
-        notread = notread[0][0] + 1, notread[1][0] + 1
-        # + 1's compensate border, avoid falling in the border
-        begpix = image_elements.Pixel(notread[0], notread[1])
-        cont, upmatread = detection_contour(matrgb, matngb, begpix)
-        matread += upmatread
-        contset.add(cont)
-    contset = contset - set((image_elements.Contour([]), ))  # Removes empty
-    return contset
+    labels, stats = zones_image(matrgb, ngl, min_area)
+    nzones = len(stats["area"])
+    for first in range(0, nzones, TRACE_BLOCK):
+        with instrument.RECORDER.stage("detection_contour"):
+            block = [detection_contour(labels, stats, label, holes=holes)
+                     for label in range(first,
+                                        min(first + TRACE_BLOCK, nzones))]
+        yield from block
 
 
 def ordercontlist(contlist):
     """Orders contour in contlist"""
-    contlist.sort(key=lambda cont: min((pix.x for pix in cont.xys)))
+    contlist.sort(key=lambda cont: cont.xys[:, 0].min())
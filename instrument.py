@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation of the pipeline: timers of stages, counters and histograms,
+reported as JSON or as a Chrome trace (chrome://tracing, Perfetto). Modules
+report to RECORDER, which does nothing until enable is called."""
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+
+class NullRecorder(object):
+    """Recorder used when instrumentation is disabled, does nothing"""
+    enabled = False
+    nullstage = contextlib.nullcontext()
+
+    def stage(self, name):
+        """See Recorder.stage"""
+        return self.nullstage
+
+    def count(self, name, number=1):
+        """See Recorder.count"""
+
+    def observe(self, name, value):
+        """See Recorder.observe"""
+
+
+class Recorder(object):
+    """Records wall and CPU time of stages, counters and histograms"""
+    enabled = True
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = {}  # name: [wall seconds, CPU seconds, calls]
+        self.counters = {}
+        self.histograms = {}  # name: {exponent: number of values}
+        self.events = []  # Chrome trace events of stages
+        self.lock = threading.Lock()  # Stages may run in several threads
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager timing the stage name, which may be entered
+        several times, or nested in other stages. CPU time is the one of this
+        process only, not of workers."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                stage = self.stages.setdefault(name, [0., 0., 0])
+                stage[0] += end - wall
+                stage[1] += time.process_time() - cpu
+                stage[2] += 1
+                self.events.append({
+                    "name": name, "ph": "X", "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "ts": (wall - self.origin) * 1e6,
+                    "dur": (end - wall) * 1e6})
+
+    def count(self, name, number=1):
+        """Adds number to counter name"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + number
+
+    def observe(self, name, value):
+        """Adds value to the histogram name, whose bins are powers of 2: value
+        is counted in bin e if 2**(e - 1) <= value < 2**e"""
+        exponent = math.frexp(value)[1] if value > 0 else None
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {})
+            histogram[exponent] = histogram.get(exponent, 0) + 1
+
+    def report(self):
+        """Dictionnary of stages, counters and histograms, for JSON"""
+        histograms = {}
+        for name, histogram in self.histograms.items():
+            bins = {"0": histogram[None]} if None in histogram else {}
+            for exponent in sorted(k for k in histogram if k is not None):
+                bins["< 2^{}".format(exponent)] = histogram[exponent]
+            histograms[name] = {"count": sum(histogram.values()),
+                                "bins": bins}
+        return {"stages": {name: {"wall": wall, "cpu": cpu, "calls": calls}
+                           for name, (wall, cpu, calls)
+                           in self.stages.items()},
+                "counters": dict(self.counters), "histograms": histograms}
+
+    def save(self, filename, chrome=False):
+        """Writes report in filename, as a Chrome trace (JSON object format,
+        report being in otherData) if chrome"""
+        if chrome:
+            end = (time.perf_counter() - self.origin) * 1e6
+            counters = [{"name": name, "ph": "C", "pid": os.getpid(),
+                         "ts": end, "args": {name: value}}
+                        for name, value in self.counters.items()]
+            content = {"traceEvents": self.events + counters,
+                       "displayTimeUnit": "ms", "otherData": self.report()}
+        else:
+            content = self.report()
+        with open(filename, 'w') as output:
+            json.dump(content, output, indent=1)
+
+
+RECORDER = NullRecorder()
+
+
+def enable():
+    """Replaces RECORDER by a new Recorder, returned"""
+    global RECORDER
+    RECORDER = Recorder()
+    return RECORDER
+
+
+def disable():
+    """Stops recording"""
+    global RECORDER
+    RECORDER = NullRecorder()
@@ -1,37 +1,191 @@
 #!/usr/bin/python3
 """Main part, takes an image as argument and vectorises it"""
 # -*- coding: utf-8 -*-
-import sys
 import argparse
-import scipy.misc
+import contextlib
+import tempfile
+import cache as stagecache
+import control_points
 import image_processing
+import instrument
+import pipeline
+import pyramid as levelpyramid
 import writesvg
-import control_points
+import tiles
+import topology
+
+
+def check_options(min_area=1, simplify=None, max_error=None, max_memory=None,
+                  cache=None, topological=False, nested=False, pyramid=0,
+                  finest=None, **others):
+    """Raises ValueError if options of main are invalid, or not supported
+    together, see main; other keyword arguments of main are ignored"""
+    if simplify is not None and simplify < 0:
+        raise ValueError("simplify must be non negative")
+    if max_error is not None and max_error < 0:
+        raise ValueError("max_error must be non negative")
+    if pyramid < 0:
+        raise ValueError("pyramid must be non negative")
+    if finest is not None and not pyramid:
+        raise ValueError("finest is only supported with pyramid")
+    if finest is not None and not 0 <= finest <= pyramid:
+        raise ValueError("finest must be between 0 and pyramid")
+    if max_memory is not None and min_area > 1:
+        raise ValueError("min_area is not supported with max_memory")
+    if max_memory is not None and cache is not None:
+        raise ValueError("cache is not supported with max_memory")
+    if (topological or nested) and (max_memory is not None or
+                                    cache is not None):
+        raise ValueError("topological and nested are not supported with "
+                         "max_memory or cache")
+    if topological and max_error is not None:
+        raise ValueError("max_error is not supported with topological")
+    if pyramid and (max_memory is not None or cache is not None or
+                    topological or nested):
+        raise ValueError("pyramid is not supported with max_memory, cache, "
+                         "topological or nested")
 
 
-def main(imagefile, ngreys):
+def main(imagefile, ngreys, jobs=1, decimals=None, merge=False,
+         max_memory=None, raw_shape=None, trace=None, chrome=False,
+         output="out.svg", verbose=True, min_area=1, simplify=None,
+         cache=None, cache_size=stagecache.MAX_BYTES, topological=False,
+         nested=False, pyramid=0, finest=None, max_error=None):
+    """Vectorises imagefile into output
+    ngreys -- number of greylevels to keep
+    jobs -- number of processes fitting curves
+    decimals -- decimals of compact relative paths, see writesvg.SvgFile
+    merge -- whether paths of a same colour are merged
+    max_memory -- if given, bytes used by the tiled pipeline (see tiles),
+        which traces contours as they are written
+    raw_shape -- shape of imagefile if it is a raw uint8 file, see
+        tiles.open_image, which reads imagefile
+    trace -- if given, file where timers and counters of instrument are
+        written, as a Chrome trace if chrome
+    output -- name of the svg file, compressed if it ends with .svgz, see
+        writesvg.SvgFile
+    verbose -- whether stages are printed
+    min_area -- zones of less pixels are merged into a neighbour, not
+        supported by the tiled pipeline
+    simplify -- if given, tolerance in pixels of the polygons whose vertices
+        are the waypoints of the curves, see control_points.curvematc
+    cache -- if given, directory where results of the stages up to the
+        ordered contours are kept for later runs, see cache.Cache, not
+        supported by the tiled pipeline
+    cache_size -- bytes of the cache
+    topological -- whether borders shared by two zones are fitted once and
+        zones drawn with the curves of their borders, see topology, not
+        supported by the tiled pipeline nor cached
+    nested -- whether zones are painted in the order of their containment
+        tree, with the curves of the zones inside as holes, see
+        topology.contours_nested: less overdraw but a larger file, not
+        supported by the tiled pipeline nor cached
+    pyramid -- if given, number of levels downsampled by powers of two
+        vectorised first, output being replaced by the svg of each level in
+        turn, see pyramid.vectorise_pyramid, not supported by the other modes
+    finest -- if given, level of the pyramid after which to stop, 0 being
+        the picture, the default, at most pyramid
+    max_error -- if given, curves are the fewest within max_error pixels of
+        the contours, fitted by least squares, see control_points.fit_contour,
+        simplify being ignored, not supported by the topological mode
+    """
     ngreys = int(ngreys)
-    matrgb = scipy.misc.imread(imagefile)
-    dim = matrgb.shape
-    print("Contours")
-    contset = image_processing.contours_image(matrgb, ngl=ngreys)
-    print("Séparation")
-    contset = list(contset)
-    navailablecont = len(contset)
-    for i in range(navailablecont):
-        contset[i].optimseparate()
-    contset = list(filter(lambda x: x.xys is not None, contset))
-    image_processing.ordercontlist(contset)
-    dim = matrgb.shape
-    svgfile = writesvg.SvgFile("out.svg", dim)
-    print("Écriture")
-    curves = []
-    for cont in contset:
-        curves = control_points.curves(cont)
-        curvemat = control_points.curves2curvematc(curves)
-        colours = {"fill": cont.colour, "stroke": cont.colour}
-        svgfile.draw_contourc(curvemat, colours)
-    svgfile.close_svg()
+    check_options(min_area=min_area, simplify=simplify, max_error=max_error,
+                  max_memory=max_memory, cache=cache,
+                  topological=topological, nested=nested, pyramid=pyramid,
+                  finest=finest)
+    recorder = instrument.enable() if trace else instrument.RECORDER
+    if verbose:
+        print("Contours")
+    if pyramid:  # Each level is written in turn
+        with recorder.stage("main"):
+            with recorder.stage("imread"):
+                matrgb = tiles.open_image(imagefile, shape=raw_shape)
+            levelpyramid.vectorise_pyramid(
+                matrgb, output, ngl=ngreys, levels=pyramid,
+                finest=0 if finest is None else finest,
+                min_area=min_area, jobs=jobs, tolerance=simplify,
+                max_error=max_error, decimals=decimals, merge=merge,
+                verbose=verbose)
+        if trace:
+            recorder.save(trace, chrome=chrome)
+            instrument.disable()
+        return
+    with tempfile.TemporaryDirectory() as workdir, recorder.stage("main"):
+        if topological:
+            with recorder.stage("imread"):
+                matrgb = tiles.open_image(imagefile, shape=raw_shape)
+            colours, loops = topology.regions_image(
+                matrgb, ngl=ngreys, min_area=min_area,
+                tolerance=topology.TOLERANCE if simplify is None else simplify,
+                jobs=jobs)
+        elif nested:
+            with recorder.stage("imread"):
+                matrgb = tiles.open_image(imagefile, shape=raw_shape)
+            contset, parents = topology.contours_nested(
+                matrgb, ngl=ngreys, min_area=min_area)
+        elif cache is not None:
+            with recorder.stage("imread"):
+                matrgb = tiles.open_image(imagefile, shape=raw_shape)
+            contset = stagecache.contours_image(
+                matrgb, stagecache.Cache(cache, cache_size), ngl=ngreys,
+                min_area=min_area)
+        elif max_memory is None:  # Contours are traced as they are fitted
+            with recorder.stage("imread"):
+                matrgb = tiles.open_image(imagefile, shape=raw_shape)
+            contset = image_processing.contours_stream(matrgb, ngl=ngreys,
+                                                       min_area=min_area)
+        else:
+            matrgb = tiles.open_image(imagefile, shape=raw_shape)
+            contset = tiles.contours_tiled(matrgb, ngreys, max_memory,
+                                           workdir)
+        dim = matrgb.shape
+        svgfile = writesvg.SvgFile(output, dim, decimals=decimals,
+                                   merge=merge)
+        if verbose:
+            print("Écriture")
+        if topological:
+            with recorder.stage("writing"):
+                for colour, zoneloops in zip(colours, loops):
+                    svgfile.draw_region(zoneloops, {
+                        "fill": colour, "stroke": colour,
+                        "stroke-width": topology.STROKE_WIDTH})
+        elif nested:
+            # Holes are the curves of the zones inside, reversed, which are
+            # all fitted before their zone is written
+            with recorder.stage("curvematcs"):
+                curvemats = list(control_points.curvematcs(
+                    contset, jobs=jobs, tolerance=simplify,
+                    max_error=max_error))
+            holes = [[] for _ in contset]
+            for index, parent in enumerate(parents.tolist()):
+                if parent >= 0:
+                    holes[parent].append(curvemats[index][::-1])
+            with recorder.stage("writing"):
+                for cont, curvemat, zoneholes in zip(contset, curvemats,
+                                                     holes):
+                    colours = {"fill": cont.colour, "stroke": cont.colour}
+                    if zoneholes:
+                        svgfile.draw_region([curvemat] + zoneholes, colours,
+                                            fill_rule="evenodd")
+                    else:
+                        svgfile.draw_contourc(curvemat, colours)
+        else:
+            # Fitted in a worker thread while written
+            with recorder.stage("curvematcs and writing"), \
+                    contextlib.closing(pipeline.buffered(pipeline.fitted(
+                        contset, jobs=jobs, tolerance=simplify,
+                        max_error=max_error))) as pairs:
+                for index, (cont, curvemat) in enumerate(pairs, 1):
+                    svgfile.draw_contourc(curvemat, {"fill": cont.colour,
+                                                     "stroke": cont.colour})
+                    if index % pipeline.BLOCK == 0:  # Written as they come
+                        svgfile.flush()
+        with recorder.stage("close_svg"):
+            svgfile.close_svg()
+    if trace:
+        recorder.save(trace, chrome=chrome)
+        instrument.disable()
 
 
 if __name__ == "__main__":
@@ -39,5 +193,64 @@ if __name__ == "__main__":
     parser.add_argument(
         "imagefile", help="Filename of the picture to be processed", nargs=1)
     parser.add_argument("ngls", help="Number of greylevels to keep", nargs=1)
-    parser.parse_args()
-    main(sys.argv[1], sys.argv[2])
+    parser.add_argument("-o", "--output", default="out.svg",
+                        help="Name of the svg file, .svgz to compress it")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes fitting curves")
+    parser.add_argument("-d", "--decimals", type=int,
+                        help="Compact relative paths with so many decimals")
+    parser.add_argument("-m", "--merge", action="store_true",
+                        help="Merge paths of a same colour")
+    parser.add_argument("-a", "--min-area", type=int, default=1,
+                        help="Zones of less pixels are merged into a "
+                        "neighbour")
+    parser.add_argument("-s", "--simplify", type=float,
+                        help="Fewer curves, the contour being simplified "
+                        "within so many pixels")
+    parser.add_argument("-e", "--max-error", type=float,
+                        help="Fewest curves within so many pixels of the "
+                        "contour, fitted by least squares")
+    parser.add_argument("-t", "--topological", action="store_true",
+                        help="Fit borders shared by two zones once, zones "
+                        "having no gaps nor overlaps")
+    parser.add_argument("-n", "--nested", action="store_true",
+                        help="Paint zones after the ones around them, "
+                        "which have holes: less overdraw, larger file")
+    parser.add_argument("-p", "--pyramid", type=int, default=0,
+                        help="Write a preview from the picture downsampled "
+                        "so many times by 2, then refine it level by level")
+    parser.add_argument("--finest", type=int,
+                        help="Level of the pyramid after which to stop, 0 "
+                        "being the picture")
+    parser.add_argument("--max-memory", type=int,
+                        help="Megabytes used by the tiled pipeline, for "
+                        "pictures larger than memory (.npy or raw files)")
+    parser.add_argument("--raw-shape", type=int, nargs="+",
+                        help="Rows, columns (and channels) of a raw uint8 "
+                        "picture")
+    parser.add_argument("--cache",
+                        help="Directory where results of stages are kept "
+                        "for later runs")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Megabytes of the cache")
+    parser.add_argument("--trace", help="JSON file of timers and counters")
+    parser.add_argument("--chrome", action="store_true",
+                        help="Trace file in Chrome format (chrome://tracing)")
+    args = parser.parse_args()
+    try:
+        check_options(min_area=args.min_area, simplify=args.simplify,
+                      max_error=args.max_error, max_memory=args.max_memory,
+                      cache=args.cache, topological=args.topological,
+                      nested=args.nested, pyramid=args.pyramid,
+                      finest=args.finest)
+    except ValueError as error:
+        parser.error(str(error))
+    max_memory = None if args.max_memory is None else args.max_memory << 20
+    main(args.imagefile[0], args.ngls[0], jobs=args.jobs,
+         decimals=args.decimals, merge=args.merge, max_memory=max_memory,
+         raw_shape=args.raw_shape, trace=args.trace, chrome=args.chrome,
+         output=args.output, min_area=args.min_area,
+         simplify=args.simplify, cache=args.cache,
+         cache_size=args.cache_size << 20, topological=args.topological,
+         nested=args.nested, pyramid=args.pyramid, finest=args.finest,
+         max_error=args.max_error)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming of the stages of main: contours are traced, fitted and written as
+they go. Tracing and fitting run in a worker thread, which hands (contour,
+control matrix) pairs to the writer through a bounded queue, so that writing
+starts with the first contours and only a few of them are held at once.
+Contours are traced, fitted and handed over by blocks: a thread waking up
+for each contour, or tracing and fitting in turn for each one, which evicts
+caches, is much slower than the work on it.
+"""
+import itertools
+import queue
+import threading
+import control_points
+
+BLOCK = 256  # Contours traced, fitted and handed over at once
+QUEUE_SIZE = 4  # Blocks waiting between the fitting and writing threads
+DONE = object()  # Last item of the queue when the worker is done
+
+
+def fitted(contours, jobs=1, tolerance=None, max_error=None, block=BLOCK):
+    """Yields (contour, control matrix) pairs, contours being read by blocks
+    of block contours, or as workers fit them with several jobs
+    contours -- iterable of Contour()
+    jobs, tolerance, max_error -- see control_points.curvematcs
+    """
+    if jobs > 1:  # Fitted by processes, one pool for all
+        contours, tofit = itertools.tee(contours)
+        yield from zip(contours, control_points.curvematcs(
+            tofit, jobs=jobs, tolerance=tolerance, max_error=max_error))
+        return
+    contours = iter(contours)
+    while True:
+        contlist = list(itertools.islice(contours, block))
+        if not contlist:
+            return
+        yield from zip(contlist, control_points.curvematcs(
+            contlist, tolerance=tolerance, max_error=max_error))
+
+
+def buffered(iterable, size=QUEUE_SIZE, batch=BLOCK):
+    """Yields the items of iterable, which is read in a worker thread at most
+    size batches of batch items ahead. Exceptions of the worker are raised
+    here, and the worker stops once this generator is closed.
+    """
+    batches = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        """Waits for room in batches, gives up if stopped"""
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        iterator = iter(iterable)
+        try:
+            while True:
+                items = list(itertools.islice(iterator, batch))
+                if not items or not put((items, None)):
+                    break
+            put((DONE, None))
+        except BaseException as error:
+            put((DONE, error))
+        finally:
+            if hasattr(iterator, "close"):  # Generators release their pool
+                iterator.close()
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    try:
+        while True:
+            items, error = batches.get()
+            if items is DONE:
+                if error is not None:
+                    raise error
+                return
+            yield from items
+    finally:
+        stop.set()
+        worker.join()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution vectorisation, for a quick preview: the picture is
+downsampled by powers of two, by means of blocks of pixels, then quantized,
+and its coarsest level is vectorised first.
+Each finer level then reuses the curves of the coarser one, scaled, for the
+zones whose contour they still follow within a threshold, and only fits the
+other zones again. Levels are yielded in turn, so that the caller can stop
+after any of them.
+"""
+import os
+import numpy as np
+import scipy.spatial
+import control_points
+import image_processing
+import instrument
+import writesvg
+
+LEVELS = 2  # Default number of levels coarser than the picture
+THRESHOLD = 2.  # Default distance in pixels above which curves are refitted
+
+
+def to_full(xys, factor):
+    """Coordinates of the bordered picture (see add_border) of points given
+    in the bordered picture of the level downsampled by factor, pixel i of the
+    level being the block of pixels factor * i to factor * (i + 1) - 1 of the
+    picture"""
+    if factor == 1:  # Same points, even -0.
+        return xys
+    return factor * (xys - 1) + (factor - 1) / 2 + 1
+
+
+def from_full(xys, factor):
+    """Inverse of to_full"""
+    return (xys - 1 - (factor - 1) / 2) / factor + 1
+
+
+def downsample(mat, factor):
+    """Means of the blocks of factor by factor pixels of mat, smaller on its
+    last rows and columns, rounded for integer matrices so that maxvalue is
+    kept"""
+    if factor == 1:
+        return mat
+    (row, col) = mat.shape[:2]
+    rows = np.arange(0, row, factor)
+    cols = np.arange(0, col, factor)
+    sums = np.add.reduceat(np.add.reduceat(mat, rows, axis=0,
+                                           dtype=np.float64), cols, axis=1)
+    counts = np.outer(np.diff(rows, append=row), np.diff(cols, append=col))
+    if sums.ndim == 3:
+        counts = counts[:, :, np.newaxis]
+    if np.issubdtype(mat.dtype, np.integer):
+        return np.rint(sums / counts).astype(mat.dtype)
+    return sums / counts
+
+
+def bezier_points(curvemat):
+    """Points of the cubic curves of curvemat, about one pixel apart
+    curvemat -- control points, see control_points.curves2curvematc
+    """
+    ctrl = np.stack((curvemat[:-1:3], curvemat[1::3], curvemat[2::3],
+                     curvemat[3::3]), axis=1)
+    lengths = np.linalg.norm(np.diff(ctrl, axis=1), axis=2).sum(axis=1)
+    counts = np.ceil(lengths).astype(np.int64) + 1
+    firsts = np.repeat(np.cumsum(counts) - counts, counts)
+    t = ((np.arange(counts.sum()) - firsts) /
+         np.repeat(counts, counts))[:, np.newaxis]
+    ctrl = np.repeat(ctrl, counts, axis=0)
+    return ((1 - t) ** 3 * ctrl[:, 0] + 3 * (1 - t) ** 2 * t * ctrl[:, 1] +
+            3 * (1 - t) * t ** 2 * ctrl[:, 2] + t ** 3 * ctrl[:, 3])
+
+
+def curve_error(curvemat, contour):
+    """Largest distance between the curves of curvemat and the pixels of
+    contour, both ways, so that curves of a larger or smaller zone do not
+    match"""
+    if len(curvemat) < 4:
+        return np.inf
+    points = bezier_points(curvemat)
+    xys = contour.xys.astype(float)
+    return max(scipy.spatial.cKDTree(points).query(xys)[0].max(),
+               scipy.spatial.cKDTree(xys).query(points)[0].max())
+
+
+def coarser_zones(labels, matq, coarselabels, coarseq):
+    """Zone of the coarser level, of same quantized greylevel, which covers
+    most of each zone of the level, -1 if there is none
+    labels, matq -- labels and quantized greylevels of the level
+    coarselabels, coarseq -- same for the level downsampled twice more
+    """
+    (row, col) = labels.shape
+    # Coarse pixel covering each pixel
+    rows = np.arange(row) // 2
+    cols = np.arange(col) // 2
+    under = coarselabels[np.ix_(rows, cols)]
+    same = coarseq[np.ix_(rows, cols)] == matq
+    ncoarse = int(coarselabels.max()) + 1
+    pairs, counts = np.unique(labels[same].astype(np.int64) * ncoarse +
+                              under[same], return_counts=True)
+    zones, coarse = np.divmod(pairs, ncoarse)
+    # Most frequent pair last for each zone
+    order = np.lexsort((counts, zones))
+    matches = np.full(int(labels.max()) + 1, -1, dtype=np.int64)
+    matches[zones[order]] = coarse[order]
+    return matches
+
+
+def pyramid_curves(matrgb, ngl=8, levels=LEVELS, threshold=THRESHOLD,
+                   min_area=1, jobs=1, tolerance=None, max_error=None):
+    """Yields, for each level from the coarsest to the picture, its
+    downsampling factor, the list of its contours in the order of
+    ordercontlist and the list of their control matrices, in the coordinates
+    of the level (see to_full)
+    matrgb -- picture
+    ngl -- number of greylevels to keep
+    levels -- number of levels coarser than the picture, each one
+        downsampled twice more than the previous one
+    threshold -- curves of the coarser level are reused, scaled, for a zone
+        when they are within threshold pixels of its contour, see curve_error
+    min_area -- see image_processing.contours_image, divided by the area of
+        the pixels of coarser levels
+    jobs, tolerance, max_error -- see control_points.curvematcs
+    """
+    recorder = instrument.RECORDER
+    with recorder.stage("pic2greylvl"):
+        matgl = image_processing.pic2greylvl(matrgb)
+    coarse = None  # Labels, quantized greylevels and curves by zone
+    for level in range(levels, -1, -1):
+        factor = 1 << level
+        with recorder.stage("downsample"):
+            levelgl = downsample(matgl, factor)
+            levelrgb = downsample(matrgb, factor)
+        with recorder.stage("colourgrouping"):
+            levelq = image_processing.colourgrouping(levelgl, ngl)
+        with recorder.stage("label_regions"):
+            labels, stats = image_processing.label_regions(levelq, levelrgb)
+        if min_area // factor ** 2 > 1:
+            with recorder.stage("merge_small_regions"):
+                labels, stats = image_processing.merge_small_regions(
+                    labels, stats, levelrgb, min_area // factor ** 2)
+        nzones = len(stats["area"])
+        recorder.count("regions", nzones)
+        with recorder.stage("detection_contour"):
+            contlist = [image_processing.detection_contour(labels, stats,
+                                                           label)
+                        for label in range(nzones)]
+        curvemats = [None] * nzones
+        if coarse is not None:
+            with recorder.stage("curve_error"):
+                coarselabels, coarseq, coarsemats = coarse
+                matches = coarser_zones(labels, levelq, coarselabels,
+                                        coarseq)
+                for label, match in enumerate(matches.tolist()):
+                    if match < 0:
+                        continue
+                    curvemat = from_full(
+                        to_full(coarsemats[match], 2 * factor), factor)
+                    if curve_error(curvemat, contlist[label]) <= threshold:
+                        curvemats[label] = curvemat
+        refit = [label for label in range(nzones) if curvemats[label] is None]
+        recorder.count("regions reused", nzones - len(refit))
+        with recorder.stage("curvematcs"):
+            fitted = control_points.curvematcs(
+                [contlist[label] for label in refit], jobs=jobs,
+                tolerance=tolerance, max_error=max_error)
+            for label, curvemat in zip(refit, fitted):
+                curvemats[label] = curvemat
+        # Same order as ordercontlist, a stable sort of zones
+        order = sorted(range(nzones),
+                       key=lambda label: contlist[label].xys[:, 0].min())
+        yield (factor, [contlist[label] for label in order],
+               [curvemats[label] for label in order])
+        coarse = (labels, levelq, curvemats)
+
+
+def vectorise_pyramid(matrgb, output, ngl=8, levels=LEVELS, finest=0,
+                      threshold=THRESHOLD, min_area=1, jobs=1, tolerance=None,
+                      max_error=None, decimals=None, merge=False,
+                      verbose=True):
+    """Writes the svg of each level of pyramid_curves to output, from the
+    coarsest one, each svg replacing the previous one once written
+    output -- name of the svg file, see writesvg.SvgFile
+    finest -- level after which to stop, 0 being the picture itself
+    levels, ngl, threshold, min_area, jobs, tolerance, max_error -- see
+        pyramid_curves
+    decimals, merge -- see writesvg.SvgFile
+    """
+    directory, name = os.path.split(output)
+    partial = os.path.join(directory, ".partial-" + name)
+    curves = pyramid_curves(matrgb, ngl, levels=levels, threshold=threshold,
+                            min_area=min_area, jobs=jobs, tolerance=tolerance,
+                            max_error=max_error)
+    for level, (factor, contlist, curvemats) in zip(
+            range(levels, finest - 1, -1), curves):
+        if verbose:
+            print("Niveau", level)
+        with instrument.RECORDER.stage("writing"):
+            svgfile = writesvg.SvgFile(partial, matrgb.shape,
+                                       decimals=decimals, merge=merge)
+            for cont, curvemat in zip(contlist, curvemats):
+                colours = {"fill": cont.colour, "stroke": cont.colour}
+                svgfile.draw_contourc(to_full(curvemat, factor), colours)
+            svgfile.close_svg()
+        os.replace(partial, output)
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Vectorisation of a sequence of frames, e.g. a video: each frame is compared
+to the previous one by tiles, and zones whose window (see detection_contour)
+lies in unchanged tiles keep the contour and curves of the previous frame.
+Only zones touching changed tiles are traced and fitted again.
+"""
+import argparse
+import os
+import numpy as np
+import batch
+import control_points
+import image_processing
+import instrument
+import main
+import tiles
+import writesvg
+
+TILE_SIZE = 32  # Side of the tiles compared between frames
+
+
+def read_frames(source):
+    """Yields the frames of source
+    source -- .npy file of shape (frames, rows, cols[, channels]), memory
+        mapped, or directory or glob pattern of pictures, see batch.inputs
+    """
+    if source.endswith(".npy") and os.path.isfile(source):
+        yield from np.load(source, mmap_mode='r')
+    else:
+        for imagefile in batch.inputs(source):
+            yield tiles.open_image(imagefile)
+
+
+def count_frames(source):
+    """Number of frames of source, see read_frames"""
+    if source.endswith(".npy") and os.path.isfile(source):
+        return len(np.load(source, mmap_mode='r'))
+    return len(batch.inputs(source))
+
+
+def dirty_tiles(matq, matrgb, prevq, prevrgb, tile=TILE_SIZE):
+    """Summed area table of the tiles where the quantized greylevels or the
+    colours differ from the previous frame, see clean_zones
+    returns -- int matrix, element (i, j) being the number of changed tiles
+        above and left of tile (i, j)
+    """
+    changed = matq != prevq
+    if matrgb.ndim == 3:  # Colours of zones are the mean of their pixels
+        changed |= np.any(matrgb != prevrgb, axis=2)
+    else:
+        changed |= matrgb != prevrgb
+    (row, col) = changed.shape
+    padded = np.zeros((-(-row // tile) * tile, -(-col // tile) * tile),
+                      dtype=bool)
+    padded[:row, :col] = changed
+    dirty = padded.reshape(len(padded) // tile, tile, -1, tile).any(
+        axis=(1, 3))
+    table = np.zeros((dirty.shape[0] + 1, dirty.shape[1] + 1), dtype=np.int64)
+    table[1:, 1:] = dirty.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def clean_zones(stats, table, shape, tile=TILE_SIZE):
+    """Whether the window of each zone, its bounding box and a margin of one
+    pixel, is only made of unchanged tiles. The zone, its colour and its
+    contour are then the same as in the previous frame.
+    stats -- see label_regions
+    table -- see dirty_tiles
+    shape -- shape of the frame
+    returns -- boolean array indexed by zone
+    """
+    bbox = stats["bbox"]
+    x0 = np.maximum(bbox[:, 0] - 1, 0) // tile
+    y0 = np.maximum(bbox[:, 1] - 1, 0) // tile
+    x1 = np.minimum(bbox[:, 2] + 1, shape[0] - 1) // tile + 1
+    y1 = np.minimum(bbox[:, 3] + 1, shape[1] - 1) // tile + 1
+    return table[x1, y1] - table[x0, y1] - table[x1, y0] + table[x0, y0] == 0
+
+
+def sequence_curves(frames, ngl, jobs=1, tolerance=None, max_error=None,
+                    tile=TILE_SIZE):
+    """Yields, for each frame, its shape, the list of its contours in the
+    order of ordercontlist and the list of their control matrices
+    frames -- iterable of pictures
+    ngl -- number of greylevels to keep
+    jobs, tolerance, max_error -- see control_points.curvematcs
+    tile -- side of the tiles compared between frames
+    """
+    recorder = instrument.RECORDER
+    prevq = prevrgb = prevlabels = None
+    previous = []  # (contour, control matrix) by zone of the previous frame
+    for matrgb in frames:
+        matrgb = np.asarray(matrgb)
+        with recorder.stage("pic2greylvl"):
+            matgl = image_processing.pic2greylvl(matrgb)
+        with recorder.stage("colourgrouping"):
+            matq = image_processing.colourgrouping(matgl, ngl)
+        with recorder.stage("label_regions"):
+            labels, stats = image_processing.label_regions(matq, matrgb)
+        nzones = len(stats["area"])
+        if prevq is not None and prevq.shape == matq.shape:
+            with recorder.stage("dirty_tiles"):
+                table = dirty_tiles(matq, matrgb, prevq, prevrgb, tile)
+                clean = clean_zones(stats, table, matq.shape, tile)
+                seeds = stats["seed"]
+                prevzones = prevlabels[seeds[:, 0], seeds[:, 1]]
+        else:
+            clean = np.zeros(nzones, dtype=bool)
+        recorder.count("regions", nzones)
+        recorder.count("regions reused", int(clean.sum()))
+        # Labels increase with the first row of zones, as ordercontlist sorts
+        dirty = np.flatnonzero(~clean).tolist()
+        with recorder.stage("detection_contour"):
+            traced = [image_processing.detection_contour(labels, stats, label)
+                      for label in dirty]
+        current = [None] * nzones
+        for label in np.flatnonzero(clean).tolist():
+            current[label] = previous[prevzones[label]]
+        with recorder.stage("curvematcs"):
+            curvemats = control_points.curvematcs(
+                traced, jobs=jobs, tolerance=tolerance, max_error=max_error)
+            for label, contour, curvemat in zip(dirty, traced, curvemats):
+                current[label] = (contour, curvemat)
+        contlist, curvematlist = zip(*current) if current else ((), ())
+        yield matrgb.shape, list(contlist), list(curvematlist)
+        prevq, prevrgb, prevlabels, previous = matq, matrgb, labels, current
+
+
+def vectorise_sequence(source, output, ngreys, jobs=1, decimals=None,
+                       merge=False, simplify=None, max_error=None,
+                       animate=False, duration=0.1, tile=TILE_SIZE,
+                       verbose=True):
+    """Vectorises the frames of source
+    source -- see read_frames
+    output -- name of the animated svg if animate, else pattern of the names
+        of the svg of the frames, formatted with the index of the frame
+        (e.g. "frames/%05d.svg")
+    ngreys -- number of greylevels to keep
+    decimals, merge -- see writesvg.SvgFile
+    simplify, max_error -- see main.main
+    animate -- whether frames are groups of one animated svg, shown in turn
+    duration -- seconds of a frame of the animation
+    """
+    main.check_options(simplify=simplify, max_error=max_error)
+    count = count_frames(source) if animate else None
+    svgfile = None
+    curves = sequence_curves(read_frames(source), int(ngreys), jobs=jobs,
+                             tolerance=simplify, max_error=max_error,
+                             tile=tile)
+    for index, (dim, contlist, curvemats) in enumerate(curves):
+        if verbose:
+            print("Frame", index)
+        with instrument.RECORDER.stage("writing"):
+            if animate:
+                if svgfile is None:
+                    svgfile = writesvg.SvgFile(output, dim, decimals=decimals,
+                                               merge=merge)
+                svgfile.open_frame(index, count, duration)
+            else:
+                name = output % index
+                if os.path.dirname(name):
+                    os.makedirs(os.path.dirname(name), exist_ok=True)
+                svgfile = writesvg.SvgFile(name, dim, decimals=decimals,
+                                           merge=merge)
+            for cont, curvemat in zip(contlist, curvemats):
+                colours = {"fill": cont.colour, "stroke": cont.colour}
+                svgfile.draw_contourc(curvemat, colours)
+            if animate:
+                svgfile.close_frame()
+            else:
+                svgfile.close_svg()
+    if animate and svgfile is not None:
+        svgfile.close_svg()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help=".npy file of frames, directory of "
+                        "pictures or glob pattern")
+    parser.add_argument("output", help="Animated svg with --animate, else "
+                        "pattern of the svg of frames, e.g. frames/%%05d.svg")
+    parser.add_argument("ngls", type=int, help="Number of greylevels to keep")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes fitting curves")
+    parser.add_argument("-d", "--decimals", type=int,
+                        help="Compact relative paths with so many decimals")
+    parser.add_argument("-m", "--merge", action="store_true",
+                        help="Merge paths of a same colour")
+    parser.add_argument("-s", "--simplify", type=float,
+                        help="Fewer curves, the contour being simplified "
+                        "within so many pixels")
+    parser.add_argument("-e", "--max-error", type=float,
+                        help="Fewest curves within so many pixels of the "
+                        "contour, fitted by least squares")
+    parser.add_argument("-a", "--animate", action="store_true",
+                        help="One animated svg of all frames")
+    parser.add_argument("--fps", type=float, default=10,
+                        help="Frames per second of the animation")
+    parser.add_argument("--tile", type=int, default=TILE_SIZE,
+                        help="Side of the tiles compared between frames")
+    parser.add_argument("--trace", help="JSON file of timers and counters")
+    args = parser.parse_args()
+    try:
+        main.check_options(simplify=args.simplify, max_error=args.max_error)
+    except ValueError as error:
+        parser.error(str(error))
+    recorder = instrument.enable() if args.trace else instrument.RECORDER
+    vectorise_sequence(args.source, args.output, args.ngls, jobs=args.jobs,
+                       decimals=args.decimals, merge=args.merge,
+                       simplify=args.simplify, max_error=args.max_error,
+                       animate=args.animate,
+                       duration=1 / args.fps, tile=args.tile)
+    if args.trace:
+        recorder.save(args.trace)
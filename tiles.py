@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorisation of pictures larger than memory: the picture is read by strips
+of rows from a memory mapped file, zones are labelled strip by strip and
+stitched across seams, labels being kept in a memory mapped file as well
+"""
+import collections
+import os
+import numpy as np
+import scipy.misc
+import scipy.sparse
+import scipy.sparse.csgraph
+import image_elements
+import image_processing
+import instrument
+
+# Bytes used by a pixel of a strip while labelling: greylevels, labels and
+# temporaries of label_regions
+BYTES_PER_PIXEL = 64
+# Bytes used by a pixel of the window of a zone while tracing, above which
+# the zone is read lazily by blocks
+BYTES_PER_WINDOW_PIXEL = 16
+BLOCK_SIZE = 256  # Side of the blocks read by LazyAround
+CACHED_BLOCKS = 64  # Blocks kept in memory by LazyAround
+
+
+def open_image(imagefile, shape=None, dtype=np.uint8):
+    """Opens a picture without reading it: .npy files and raw files are
+    memory mapped, other formats are read by scipy.misc.imread, which loads
+    the whole picture
+    imagefile -- name of the file
+    shape -- (rows, cols) or (rows, cols, channels) of a raw file
+    dtype -- dtype of a raw file
+    """
+    if shape is not None:
+        return np.memmap(imagefile, dtype=dtype, mode='r', shape=tuple(shape))
+    if imagefile.endswith(".npy"):
+        return np.load(imagefile, mmap_mode='r')
+    return scipy.misc.imread(imagefile)
+
+
+def strip_rows(shape, max_memory):
+    """Number of rows of the strips labelled at once within max_memory bytes
+    shape -- shape of the picture
+    """
+    return max(int(max_memory // (BYTES_PER_PIXEL * max(shape[1], 1))), 1)
+
+
+def label_strips(matrgb, ngl, labels, rows):
+    """Same as label_regions applied to colourgrouping(pic2greylvl(matrgb),
+    ngl), strip by strip. Zones of a strip are numbered after those of
+    previous strips, zones of two strips touching on their seam are then
+    joined as connected components of a graph. As zones of strips are
+    numbered in raster scan order, the smallest zone of a component gives its
+    number, seed and first row.
+    matrgb -- picture, e.g. memory mapped by open_image
+    ngl -- number of greylevels to keep
+    labels -- int32 matrix of the shape of the picture, e.g. memory mapped,
+        in which labels are written
+    rows -- number of rows of a strip, see strip_rows
+    returns -- stats, see label_regions
+    """
+    nrows = len(labels)
+    parts = []  # Stats of the zones of each strip
+    links = []  # Zones joined on seams
+    nzones = 0
+    lastq = lastlabels = None
+    for i in range(0, nrows, rows):
+        strip = np.asarray(matrgb[i:i + rows])
+        matq = image_processing.colourgrouping(
+            image_processing.pic2greylvl(strip), ngl)
+        striplabels, stats = image_processing.label_regions(matq, strip)
+        colour = image_processing.colour_sums(
+            striplabels, strip, len(stats["area"]))
+        striplabels += nzones
+        bbox = stats["bbox"] + (i, 0, i, 0)
+        seed = stats["seed"] + (i, 0)
+        parts.append((stats["area"], bbox, seed, colour))
+        if lastq is not None:
+            same = lastq == matq[0]
+            links.append(np.stack((lastlabels[same], striplabels[0][same])))
+        labels[i:i + rows] = striplabels
+        lastq, lastlabels = matq[-1].copy(), striplabels[-1].copy()
+        nzones += len(stats["area"])
+    area, bbox, seed, colour = (np.concatenate(stat) for stat in zip(*parts))
+    links = np.concatenate(links, axis=1) if links else \
+        np.empty((2, 0), dtype=np.int32)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(links.shape[1], dtype=np.int8), (links[0], links[1])),
+        shape=(nzones, nzones))
+    ncomponents, components = scipy.sparse.csgraph.connected_components(
+        graph, directed=False)
+    # Numbering components by their first zone
+    _, firstzones = np.unique(components, return_index=True)
+    order = np.argsort(firstzones)
+    renum = np.empty(ncomponents, dtype=np.int32)
+    renum[order] = np.arange(ncomponents, dtype=np.int32)
+    components = renum[components]
+    firstzones = firstzones[order]
+    for i in range(0, nrows, rows):
+        labels[i:i + rows] = components[labels[i:i + rows]]
+    byzone = np.argsort(components, kind='stable')
+    firsts = np.searchsorted(components[byzone], np.arange(ncomponents))
+    merged = np.empty((ncomponents, 4), dtype=np.int64)
+    merged[:, 0] = bbox[firstzones, 0]
+    merged[:, 1] = np.minimum.reduceat(bbox[byzone, 1], firsts)
+    merged[:, 2] = np.maximum.reduceat(bbox[byzone, 2], firsts)
+    merged[:, 3] = np.maximum.reduceat(bbox[byzone, 3], firsts)
+    area = np.bincount(components, weights=area,
+                       minlength=ncomponents).astype(np.int64)
+    colour = np.stack([np.bincount(components, weights=colour[:, k],
+                                   minlength=ncomponents) for k in range(3)],
+                      axis=1)
+    colour *= 255 / image_processing.maxvalue(matrgb) / area[:, np.newaxis]
+    return {"area": area, "bbox": merged, "seed": seed[firstzones],
+            "colour": colour}
+
+
+class LazyAround(object):
+    """Zone of labels and its closest neighbours, as the around mask of
+    detection_contour, padded and flattened for trace_flat, computed by
+    blocks when they are read"""
+
+    def __init__(self, labels, bbox, label):
+        """
+        labels -- matrix of labels, e.g. memory mapped
+        bbox -- bounding box of the zone, see label_regions
+        label -- zone
+        """
+        self.labels = labels
+        self.label = label
+        # Window of detection_contour, margin of 1, then padding of 1
+        self.xmin, self.ymin = int(bbox[0]) - 2, int(bbox[1]) - 2
+        self.width = int(bbox[3] - bbox[1]) + 5
+        self.blocks = collections.OrderedDict()
+
+    def __getitem__(self, pos):
+        x, y = divmod(pos, self.width)
+        if y == 0 or y == self.width - 1:  # Padding
+            return False
+        key = (x // BLOCK_SIZE, y // BLOCK_SIZE)
+        block = self.blocks.get(key)
+        if block is None:
+            block = self.block(*key)
+        else:
+            self.blocks.move_to_end(key)
+        return block[(x % BLOCK_SIZE) * BLOCK_SIZE + y % BLOCK_SIZE]
+
+    def block(self, bx, by):
+        """Computes block (bx, by) and caches it"""
+        (row, col) = self.labels.shape
+        x0 = self.xmin + bx * BLOCK_SIZE - 1  # With closest neighbours
+        y0 = self.ymin + by * BLOCK_SIZE - 1
+        read = np.zeros((BLOCK_SIZE + 2, BLOCK_SIZE + 2), dtype=bool)
+        xs, ys = max(x0, 0), max(y0, 0)
+        xe = min(x0 + BLOCK_SIZE + 2, row)
+        ye = min(y0 + BLOCK_SIZE + 2, col)
+        if xs < xe and ys < ye:
+            read[xs - x0:xe - x0, ys - y0:ye - y0] = \
+                self.labels[xs:xe, ys:ye] == self.label
+        around = read[1:-1, 1:-1] | read[:-2, 1:-1] | read[2:, 1:-1] | \
+            read[1:-1, :-2] | read[1:-1, 2:]
+        block = around.tobytes()
+        self.blocks[(bx, by)] = block
+        if len(self.blocks) > CACHED_BLOCKS:
+            self.blocks.popitem(last=False)
+        return block
+
+
+def detection_contour_lazy(labels, stats, label):
+    """Same as detection_contour without holes, the window of the zone being
+    read by blocks from labels
+    """
+    xmin, ymin = stats["bbox"][label][:2]
+    around = LazyAround(labels, stats["bbox"][label], label)
+    begin = (0, stats["seed"][label][1] - ymin + 1)
+    path = image_processing.trace_flat(around, around.width, begin)
+    instrument.RECORDER.count("pixels traced", len(path))
+    contour = image_elements.Contour(
+        image_processing.firstoccurrences(path + (xmin, ymin)))
+    instrument.RECORDER.count("contour points", len(contour))
+    contour.colour = image_processing.vec2hex(stats["colour"][label])
+    return contour
+
+
+def contours_tiled(matrgb, ngl, max_memory, workdir, holes=False):
+    """Yields the contours of the picture, in the order of contours_image
+    sorted by ordercontlist, using about max_memory bytes besides the
+    statistics of zones and the contour being traced
+    matrgb -- picture, e.g. memory mapped by open_image
+    ngl -- number of greylevels to keep
+    max_memory -- bytes
+    workdir -- directory where labels are memory mapped
+    holes -- whether contours of holes are computed, except for zones too
+        large to be read at once, see detection_contour
+    """
+    labels = np.lib.format.open_memmap(
+        os.path.join(workdir, "labels.npy"), mode='w+', dtype=np.int32,
+        shape=matrgb.shape[:2])
+    with instrument.RECORDER.stage("label_strips"):
+        stats = label_strips(matrgb, ngl, labels,
+                             strip_rows(matrgb.shape, max_memory))
+    instrument.RECORDER.count("regions", len(stats["area"]))
+    sizes = (stats["bbox"][:, 2] - stats["bbox"][:, 0] + 3) * \
+        (stats["bbox"][:, 3] - stats["bbox"][:, 1] + 3)
+    # Labels increase with the first row of zones, as ordercontlist sorts
+    for label in range(len(stats["area"])):
+        if sizes[label] * BYTES_PER_WINDOW_PIXEL <= max_memory:
+            yield image_processing.detection_contour(labels, stats, label,
+                                                     holes=holes)
+        else:
+            yield detection_contour_lazy(labels, stats, label)
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Topological vectorisation: borders between zones are followed on the cracks
+between pixels, cut at junctions into edges shared by two zones, and each
+edge is fitted once. Zones are then drawn with references to the fitted edges
+around them, so that neighbours share the very same curves, without gaps nor
+overlaps.
+"""
+import concurrent.futures
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import control_points
+import image_elements
+import image_processing
+import instrument
+
+TOLERANCE = 1.  # Default tolerance of the simplification of edges, in pixels
+CHUNK_POINTS = 1 << 16  # Points of edges fitted by a job at once
+# Width of the stroke of the colour of a zone drawn around it: two
+# anti-aliased fills on the same curve let the background through. A zone
+# spills half of it over the zones drawn before it; a hairline of half a
+# pixel still leaves most seams
+STROKE_WIDTH = 0.75
+
+
+def crack_edges(labels):
+    """Edges of the borders between zones. A crack is the side shared by two
+    pixels of different zones, or by a pixel and the outside of the picture,
+    and goes between two corners of pixels, corner (r, c) being the upper
+    left one of pixel (r, c). Cracks are oriented so that the zone of smaller
+    label, or the outside, is on their left, then chained through corners
+    where only two cracks meet. Chains are cut at other corners, junctions,
+    or at their first crack if they are loops without junction.
+    labels -- matrix of labels, see label_regions
+    returns -- dictionnary of arrays indexed by edge:
+        "offsets" -- edge e goes through points[offsets[e]:offsets[e + 1]]
+        "points" -- (n, 2) int array of corners of all edges, end to end
+        "cycles" -- whether the edge is a loop without junction
+        "sides" -- (label on the left, label on the right), -1 being the
+            outside, the left one being smaller
+    """
+    (row, col) = labels.shape
+    width = col + 1  # Corners by row
+    padded = np.full((row + 2, col + 2), -1, dtype=np.int64)
+    padded[1:-1, 1:-1] = labels
+    # Horizontal cracks from (r, c) to (r, c + 1), pixel above on the left
+    above, below = padded[:-1, 1:-1], padded[1:, 1:-1]
+    hrs, hcs = np.nonzero(above != below)
+    # Vertical cracks from (r, c) to (r + 1, c), pixel right on the left
+    left, right = padded[1:-1, :-1], padded[1:-1, 1:]
+    vrs, vcs = np.nonzero(left != right)
+    starts = np.concatenate((hrs * width + hcs, vrs * width + vcs))
+    ends = np.concatenate((starts[:len(hrs)] + 1, starts[len(hrs):] + width))
+    lefts = np.concatenate((above[hrs, hcs], right[vrs, vcs]))
+    rights = np.concatenate((below[hrs, hcs], left[vrs, vcs]))
+    flip = lefts > rights
+    starts[flip], ends[flip] = ends[flip], starts[flip].copy()
+    lefts[flip], rights[flip] = rights[flip], lefts[flip].copy()
+    ncracks = len(starts)
+    degrees = np.bincount(starts, minlength=(row + 1) * width) + \
+        np.bincount(ends, minlength=(row + 1) * width)
+    # Through a corner of two cracks, a chain keeps the same zones on each
+    # side, hence one crack ends there and the other one starts there
+    startat = np.full(len(degrees), -1, dtype=np.int64)
+    passing = degrees[starts] == 2
+    startat[starts[passing]] = np.flatnonzero(passing)
+    succ = np.where(degrees[ends] == 2, startat[ends], -1)
+    linked = np.flatnonzero(succ >= 0)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(linked), dtype=np.int8), (linked, succ[linked])),
+        shape=(ncracks, ncracks))
+    nedges, chains = scipy.sparse.csgraph.connected_components(
+        graph, directed=False)
+    # Chains without junction are loops, cut before their first crack
+    heads = np.zeros(nedges, dtype=bool)
+    heads[chains[~passing]] = True
+    cycles = ~heads
+    _, firsts = np.unique(chains, return_index=True)
+    loopfirsts = firsts[cycles]
+    pred = np.full(ncracks, -1, dtype=np.int64)
+    pred[succ[linked]] = linked
+    succ[pred[loopfirsts]] = -1
+    # Distance of each crack to the end of its chain, by pointer jumping
+    nexts = succ.copy()
+    distances = (succ >= 0).astype(np.int64)
+    while True:
+        valid = nexts >= 0
+        if not valid.any():
+            break
+        distances = distances + np.where(valid, distances[nexts], 0)
+        nexts = np.where(valid, nexts[nexts], -1)
+    order = np.lexsort((-distances, chains))
+    counts = np.bincount(chains, minlength=nedges)
+    # Each edge has the starts of its cracks, then the end of the last one
+    offsets = np.zeros(nedges + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts + 1)
+    corners = np.empty(offsets[-1], dtype=np.int64)
+    positions = np.arange(ncracks) + np.repeat(np.arange(nedges), counts)
+    corners[positions] = starts[order]
+    lasts = order[np.cumsum(counts) - 1]
+    corners[offsets[1:] - 1] = ends[lasts]
+    firstcracks = order[offsets[:-1] - np.arange(nedges)]
+    return {"offsets": offsets,
+            "points": np.stack(np.divmod(corners, width), axis=1),
+            "cycles": cycles,
+            "sides": np.stack((lefts[firstcracks], rights[firstcracks]),
+                              axis=1)}
+
+
+def fit_edge(points, cycle, tolerance=TOLERANCE):
+    """Control matrix of the cubic Bezier curves of an edge, see curvematc,
+    waypoints being the vertices of its simplification
+    points -- (n + 1, 2) array of corners, see crack_edges
+    cycle -- whether the edge is a loop without junction, fitted as a closed
+        contour, else its ends are junctions and kept as waypoints, tangents
+        at them going to the next waypoint
+    """
+    if cycle:
+        return control_points.curvematc(
+            image_elements.Contour(points[:-1]), tolerance)
+    xys = np.asarray(points, dtype=float)
+    keep = np.zeros(len(xys), dtype=bool)
+    if np.array_equal(xys[0], xys[-1]):  # Loop through a junction
+        keep[np.argmax(image_elements.norms(xys - xys[0]))] = True
+    indices = image_elements.simplify_polyline(xys, tolerance, keep)
+    last = len(xys) - 1
+    paratans = np.empty((len(indices), 2))
+    inner = indices[1:-1]
+    if len(inner):
+        # Precision as for closed contours, without going past the ends
+        gaps = np.maximum(np.diff(indices), 3)
+        precisions = np.minimum(np.minimum(gaps[:-1], gaps[1:]),
+                                np.minimum(inner, last - inner))
+        paratans[1:-1] = image_elements.tangents(xys, inner, precisions)[0]
+    for k, chord in ((0, xys[indices[1]] - xys[0]),
+                     (-1, xys[-1] - xys[indices[-2]])):
+        paratans[k] = chord / np.hypot(*chord)
+    return control_points.usecubs(xys[indices], paratans)
+
+
+def fit_chunk(edges, tolerance):
+    """fit_edge of each (points, cycle) of edges, in a worker"""
+    return [fit_edge(points, cycle, tolerance) for points, cycle in edges]
+
+
+def fit_edges(edges, tolerance=TOLERANCE, jobs=1):
+    """Control matrices of all the edges given by crack_edges, fitted in a
+    pool of processes if jobs > 1"""
+    offsets = edges["offsets"].tolist()
+    items = [(edges["points"][begin:end], cycle) for begin, end, cycle in zip(
+        offsets[:-1], offsets[1:], edges["cycles"].tolist())]
+    if jobs <= 1:
+        return fit_chunk(items, tolerance)
+    chunks = [[]]
+    size = 0
+    for item in items:
+        chunks[-1].append(item)
+        size += len(item[0])
+        if size >= CHUNK_POINTS:
+            chunks.append([])
+            size = 0
+    curvemats = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        for result in pool.map(fit_chunk, chunks,
+                               [tolerance] * len(chunks)):
+            curvemats.extend(result)
+    return curvemats
+
+
+def edge_loops(edges, nzones):
+    """Loops of edges around each zone, each edge being taken forward by the
+    zone on its left and reversed by the one on its right, so that zones are
+    on the left of all their loops: the outer one turns counterclockwise,
+    with a positive area, and the ones of holes clockwise. Where the zone
+    touches itself by a corner, loops turn left, around the pixel they come
+    along: zones are 4-connected and holes 8-connected, as for
+    detection_contour.
+    returns -- list indexed by zone of lists of loops, lists of (edge,
+        reversed)
+    """
+    points = edges["points"]
+    offsets = edges["offsets"]
+    firsts = points[offsets[:-1]].tolist()  # Corners where edges start
+    lasts = points[offsets[1:] - 1].tolist()
+    outs = (points[offsets[:-1] + 1] - points[offsets[:-1]]).tolist()
+    ins = (points[offsets[1:] - 1] - points[offsets[1:] - 2]).tolist()
+
+    def leave(edge, reverse):
+        """Corner where edge starts, and direction of its first step, as
+        traversed"""
+        if reverse:
+            return tuple(lasts[edge]), (-ins[edge][0], -ins[edge][1])
+        return tuple(firsts[edge]), tuple(outs[edge])
+
+    def arrive(edge, reverse):
+        """Corner where edge ends, and direction of its last step"""
+        if reverse:
+            return tuple(firsts[edge]), (-outs[edge][0], -outs[edge][1])
+        return tuple(lasts[edge]), tuple(ins[edge])
+
+    around = [[] for _ in range(nzones)]
+    for edge, (left, right) in enumerate(edges["sides"].tolist()):
+        if left >= 0:
+            around[left].append((edge, False))
+        around[right].append((edge, True))
+    loops = []
+    for zone in range(nzones):
+        leaving = {}  # Edges of the zone by corner: {direction: edge}
+        for edge, reverse in around[zone]:
+            position, direction = leave(edge, reverse)
+            leaving.setdefault(position, {})[direction] = (edge, reverse)
+        # Loops begin where the way is unambiguous when possible
+        starts = sorted(leaving, key=lambda corner: len(leaving[corner]))
+        zoneloops = []
+        for position in starts:
+            loop = []
+            while position in leaving:
+                outgoing = leaving[position]
+                if loop and len(outgoing) > 1:  # Zone touching itself
+                    (dx, dy) = direction
+                    step = outgoing.pop((-dy, dx), None)  # Turning left
+                    if step is None:
+                        step = outgoing.popitem()[1]
+                else:
+                    step = outgoing.popitem()[1]
+                if not outgoing:
+                    del leaving[position]
+                loop.append(step)
+                position, direction = arrive(*step)
+            if loop:
+                zoneloops.append(loop)
+        loops.append(zoneloops)
+    return loops
+
+
+def zone_loops(edges, curvemats, nzones):
+    """Closed polybeziers around each zone, see edge_loops, made of the
+    control matrices of its edges
+    returns -- list indexed by zone of lists of control matrices
+    """
+    loops = []
+    for zoneloops in edge_loops(edges, nzones):
+        loops.append([np.concatenate(
+            [curvemats[edge][::-1] if reverse else curvemats[edge]
+             for edge, reverse in loop[:1]] +
+            [curvemats[edge][-2::-1] if reverse else curvemats[edge][1:]
+             for edge, reverse in loop[1:]]) for loop in zoneloops])
+    return loops
+
+
+def containment(labels, stats, edges=None):
+    """Containment tree of the zones. A zone lies in a hole of its parent,
+    the smallest zone around it: either it is beyond a loop of a hole of a
+    zone, which is then its parent, or it has the same parent as the zone
+    just above its seed, which comes first in raster scan order.
+    labels, stats -- see label_regions
+    edges -- crack_edges(labels), computed if not given
+    returns -- (parents, depths, holes) arrays indexed by zone: parent, -1
+        for zones in no other, depth in the tree, 0 for those, and number of
+        holes
+    """
+    if edges is None:
+        edges = crack_edges(labels)
+    nzones = len(stats["area"])
+    # Signed area of the polygon of each edge, by the shoelace formula
+    points = edges["points"].astype(np.int64)
+    offsets = edges["offsets"]
+    terms = points[:-1, 0] * points[1:, 1] - points[1:, 0] * points[:-1, 1]
+    terms[offsets[1:-1] - 1] = 0  # From an edge to the next one
+    areas = np.add.reduceat(terms, offsets[:-1])
+    parents = np.full(nzones, -1, dtype=np.int64)
+    holes = np.zeros(nzones, dtype=np.int64)
+    sides = edges["sides"]
+    for zone, zoneloops in enumerate(edge_loops(edges, nzones)):
+        for loop in zoneloops:
+            loopedges, reverses = zip(*loop)
+            reverses = np.array(reverses)
+            if np.dot(areas[list(loopedges)], 1 - 2 * reverses) < 0:  # Hole
+                holes[zone] += 1
+                # Zones beyond the loop, on the other side of its edges
+                parents[sides[loopedges, reverses.astype(int) ^ 1]] = zone
+    depths = np.zeros(nzones, dtype=np.int64)
+    seeds = stats["seed"]
+    above = np.where(seeds[:, 0] > 0, labels[np.maximum(seeds[:, 0] - 1, 0),
+                                              seeds[:, 1]], -1).tolist()
+    parentlist = parents.tolist()
+    depthlist = depths.tolist()
+    for zone in range(nzones):
+        if parentlist[zone] < 0 and above[zone] >= 0:
+            parentlist[zone] = parentlist[above[zone]]
+        if parentlist[zone] >= 0:
+            depthlist[zone] = depthlist[parentlist[zone]] + 1
+    return np.array(parentlist), np.array(depthlist), holes
+
+
+def regions_image(matrgb, ngl=8, min_area=1, tolerance=TOLERANCE, jobs=1):
+    """Colours of the zones of the picture and their loops, see zone_loops,
+    computed as contours_image does, every edge being fitted once
+    returns -- (list of colours, list of lists of control matrices)
+    """
+    recorder = instrument.RECORDER
+    labels, stats = image_processing.zones_image(matrgb, ngl, min_area)
+    with recorder.stage("crack_edges"):
+        edges = crack_edges(labels)
+    recorder.count("edges", len(edges["cycles"]))
+    with recorder.stage("fit_edges"):
+        curvemats = fit_edges(edges, tolerance, jobs)
+    with recorder.stage("zone_loops"):
+        loops = zone_loops(edges, curvemats, len(stats["area"]))
+    colours = [image_processing.vec2hex(colour)
+               for colour in stats["colour"]]
+    return colours, loops
+
+
+def contours_nested(matrgb, ngl=8, min_area=1):
+    """Same as contours_image, in the order of the containment tree instead
+    of ordercontlist: zones are painted after the one around them, by depth,
+    then in raster scan order. Holes are not traced: a zone is to be drawn
+    with the curves of the zones inside it, reversed, as holes, so that it
+    need not be painted under them and each contour is fitted once.
+    returns -- (contours, parents), parents[i] being the index in contours
+        of the zone around contours[i], -1 if none
+    """
+    recorder = instrument.RECORDER
+    labels, stats = image_processing.zones_image(matrgb, ngl, min_area)
+    with recorder.stage("containment"):
+        parents, depths, _ = containment(labels, stats)
+    order = np.argsort(depths, kind='stable')
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+    parents = np.where(parents >= 0, positions[parents], -1)[order]
+    with recorder.stage("detection_contour"):
+        contlist = [image_processing.detection_contour(labels, stats, label)
+                    for label in order.tolist()]
+    return contlist, parents
@@ -1,25 +1,151 @@
 """Defines a class for creating a svgfile"""
+import gzip
+import io
+import re
+import sys
+import numpy as np
+import instrument
+
+BUFFER_SIZE = 1 << 20  # Characters kept before writing to the file
+PATH_BATCH = 1024  # Contours kept to be formatted together
+# Shortening of numbers formatted with decimals, replacements are plain
+# strings to keep re from calling back Python for each match
+TRAILING_ZEROS = re.compile(r"(?<=[1-9])0+(?![\d.])")  # 1.50 -> 1.5
+ZERO_DECIMALS = re.compile(r"\.0+(?!\d)")  # 1.00 -> 1
+MINUS_ZERO = re.compile(r"-0(?![\d.])")  # -0 -> 0
+LEADING_ZERO = re.compile(r"(?<![\d.])0(?=\.)")  # 0.5 -> .5
+
+
+def shorten_numbers(string, decimals):
+    """Writes the numbers of a path with as few characters as possible,
+    e.g. "-0.500 1.000 -0.000" becomes "-.5 1 0"
+    string -- path data, all numbers formatted with decimals decimals
+    """
+    if decimals > 0:
+        string = ZERO_DECIMALS.sub("", TRAILING_ZEROS.sub("", string))
+    string = LEADING_ZERO.sub("", MINUS_ZERO.sub("0", string))
+    return string.replace(" -", "-")
+
+
+def compact_paths(ctrl_mats, decimals):
+    """Path data of closed polybeziers with relative coordinates, computed
+    for all of them at once. A curve is written with the smooth command s
+    when its first control point is the reflection of the previous second
+    control point, as written, up to the precision of the output, c
+    otherwise.
+    ctrl_mats -- list of control matrices, (3 m + 1, 2) arrays, see
+        draw_contourc
+    decimals -- number of decimals of control points
+    returns -- list of path data, one per control matrix
+    """
+    ncurves = np.array([len(ctrl_mat) // 3 for ctrl_mat in ctrl_mats])
+    offsets = np.cumsum([0] + [len(ctrl_mat) for ctrl_mat in ctrl_mats])
+    ctrls = np.concatenate(ctrl_mats)
+    # Rank of each curve in its polybezier, row of its start in ctrls
+    firsts = np.cumsum(ncurves) - ncurves
+    ranks = np.arange(ncurves.sum()) - np.repeat(firsts, ncurves)
+    starts = np.repeat(offsets[:-1], ncurves) + 3 * ranks
+    # Point, control points and end of each curve, relative to its start
+    rel = np.empty((len(starts), 4, 2))
+    rel[:, 0] = ctrls[starts]
+    rel[:, 1:] = ctrls[starts[:, np.newaxis] + (1, 2, 3)] - \
+        rel[:, :1]
+    written = np.round(rel[:, 1:], decimals)
+    # Reflection of the second control point, relative to the end point
+    implied = written[:-1, 2] - written[:-1, 1]
+    smooth = np.zeros(len(rel), dtype=bool)
+    smooth[1:] = np.all(np.abs(implied - rel[1:, 1]) <= 0.5 * 10. ** -decimals,
+                        axis=1)
+    smooth[firsts] = False
+    kept = np.ones(rel.shape[:2], dtype=bool)
+    kept[:, 0] = ranks == 0  # Absolute start of each polybezier
+    kept[smooth, 1] = False
+    lasts = np.zeros(len(rel), dtype=bool)
+    lasts[firsts + ncurves - 1] = True
+    number = "%.{}f".format(decimals)
+    formats = []  # By first, smooth and last curve
+    for command in ("c" + " ".join((number, ) * 6),
+                    "s" + " ".join((number, ) * 4)):
+        for begin in ("", "M{0} {0}".format(number)):
+            formats.append(begin + command)
+            formats.append(begin + command + "z\n")
+    codes = 4 * smooth + 2 * (ranks == 0) + lasts
+    pathsformat = "".join([formats[code] for code in codes.tolist()])
+    return shorten_numbers(
+        pathsformat % tuple(rel[kept].ravel().tolist()),
+        decimals).split("\n")[:-1]
 
 
 class SvgFile(object):
     """A SVG files, with methods to write bezier curves, pixels and close it"""
 
-    def __init__(self, name, dim):
+    def __init__(self, name, dim, compress=None, buffering=BUFFER_SIZE,
+                 decimals=None, merge=False):
         """Links a file to object
-        name -- name of the file (string)
+        name -- name of the file (string), "-" for the standard output, or
+            file-like object (opened in binary mode to be compressed)
         dim -- tuble of int, dimension of svg image. Be careful! An image
             of dimension (16, 16) can contain up to 17 pixel object per line or
             row (e.g. when using draw_pix), from 0 to 16, bounds included.
             Someone who wants to draw the pixels of an sp.array of dim 16, 16
             should have dim = (15, 15).
+        compress -- whether output is gzipped (svgz), by default if name ends
+            with .svgz
+        buffering -- number of characters kept before writing to the file
+        decimals -- if given, contours are written with relative commands and
+            this number of decimals (see compact_path), else with absolute
+            coordinates and 6 decimals
+        merge -- whether contours of a same colour are merged into one path
+            when paint order allows it, merged paths being written on closing
         """
         self.dim = dim
-        self.file = open(name, 'w')
+        if compress is None:
+            compress = isinstance(name, str) and name.endswith(".svgz")
+        self.owned = isinstance(name, str)  # Whether file is ours to close
+        if name == "-":
+            name = sys.stdout.buffer
+            self.owned = False
+        if compress:
+            if self.owned:
+                self.file = gzip.open(name, 'wb')
+            else:  # Only the compressed stream is closed
+                self.file = gzip.GzipFile(fileobj=name, mode='wb')
+            self.owned = True
+        elif self.owned:
+            self.file = open(name, 'wb')
+        else:
+            self.file = name
+        self.text = isinstance(self.file, io.TextIOBase)
+        self.buffering = buffering
+        self.buffer = []
+        self.buffered = 0
+        self.decimals = decimals
+        self.merge = merge
+        self.paths = []  # Contours to be written: (ctrl_mat, colours)
+        self.groups = []  # Merged paths: [colours, bbox, list of path data]
         self.svgskel(dim)
 
     def write(self, string):
-        """Shortcut for self.file.write(string)"""
+        """Buffered self.file.write(string), after pending contours"""
+        if self.paths:
+            self.write_paths()
+        self.buffer.append(string)
+        self.buffered += len(string)
+        if self.buffered >= self.buffering:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending contours, unless they are merged, and the buffer
+        to the file"""
+        if self.paths:
+            self.write_paths()
+        string = "".join(self.buffer)
+        if not self.text:
+            string = string.encode()
         self.file.write(string)
+        instrument.RECORDER.count("bytes written", len(string))
+        self.buffer = []
+        self.buffered = 0
 
     def svgskel(self, dim):
         """ Writes the skeleton of the svg file 'self'
@@ -57,10 +183,13 @@ class SvgFile(object):
 
     def close_path(self, colours):
         """Closes path and add parameters
-        colours -- dictionnary containing colours: stroke and fill
+        colours -- dictionnary containing colours: stroke and fill, and
+            possibly the width of the stroke, "stroke-width"
         """
-        self.write("\" stroke=\"{}\" fill=\"{}\"/>\n".format(colours["stroke"],
-                                                             colours["fill"]))
+        self.write("\" stroke=\"{}\"".format(colours["stroke"]))
+        if "stroke-width" in colours:
+            self.write(" stroke-width=\"{}\"".format(colours["stroke-width"]))
+        self.write(" fill=\"{}\"/>\n".format(colours["fill"]))
 
     def add_polybezier(self, ctrl_pts):
         """Adds a quadratic Bezier curve in an opened path, i.e. a
@@ -81,10 +210,66 @@ class SvgFile(object):
         self.write(
             ", {:d} {:d}".format(int(ctrl_pts[2, 0]), int(ctrl_pts[2, 1])))
 
+    def merge_path(self, pathdata, colours, bbox):
+        """Adds a path to the last group of its colour if no group painted
+        after it overlaps the path, else creates a group at the end
+        pathdata -- path data, value of attribute d
+        colours -- dictionnary containing stroke and fill colour
+        bbox -- (xmin, ymin, xmax, ymax), bounding box of what the path paints
+        """
+        xmin, ymin, xmax, ymax = bbox
+        for group in reversed(self.groups):
+            gxmin, gymin, gxmax, gymax = group[1]
+            if group[0] == colours:
+                group[1] = (min(gxmin, xmin), min(gymin, ymin),
+                            max(gxmax, xmax), max(gymax, ymax))
+                group[2].append(pathdata)
+                return
+            if gxmin <= xmax and xmin <= gxmax and \
+                    gymin <= ymax and ymin <= gymax:
+                break
+        self.groups.append([colours, tuple(bbox), [pathdata]])
+
+    def write_groups(self):
+        """Writes the merged paths. All contours turn the same way, hence
+        nonzero fill rule fills all of their area"""
+        for colours, _, pathdatas in self.groups:
+            self.open_path()
+            self.write(" ".join(pathdatas))
+            if len(pathdatas) > 1:
+                self.write("\" fill-rule=\"nonzero")
+            self.close_path(colours)
+        self.groups = []
+
+    def open_frame(self, index, count, duration):
+        """Opens a group only shown during frame index of an animation of
+        count frames, looping
+        duration -- seconds of a frame
+        """
+        self.write("\t<g display=\"none\">\n")
+        self.write(
+            "\t<animate attributeName=\"display\" "
+            "values=\"none;inline;none\" keyTimes=\"0;{:.6g};{:.6g}\" "
+            "dur=\"{:.6g}s\" calcMode=\"discrete\" "
+            "repeatCount=\"indefinite\"/>\n".format(
+                index / count, (index + 1) / count, count * duration))
+
+    def close_frame(self):
+        """Closes the group of open_frame, after pending paths"""
+        self.write_paths()
+        self.write_groups()
+        self.write("\t</g>\n")
+
     def close_svg(self):
         """Closes svg file"""
+        self.write_paths()
+        self.write_groups()
         self.write("</svg>")
-        self.file.close()
+        self.flush()
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
 
     def draw_contour(self, ctrl_mat, colours=None):
         """Draws a contour with quadratic bezier curves which control points
@@ -100,24 +285,102 @@ class SvgFile(object):
         assert ctrl_mat[3:, ].shape[0] % 2 == 0  # Pair of points except first
         n_bezier = ctrl_mat[3:, ].shape[0] // 2  # Number of curves
         self.open_path()
-        self.begin_bezier(ctrl_mat[:4, ])
-        for i in range(3, 3 + 2 * n_bezier, 2):
-            self.add_polybezier(ctrl_mat[i:i + 2, ])
+        pathformat = "M %d %d Q %.6f %.6f, %d %d" + \
+            ", %.6f %.6f, %d %d" * n_bezier
+        self.write(
+            pathformat % tuple(ctrl_mat[:3 + 2 * n_bezier].ravel().tolist()))
         self.close_path(colours)
 
     def draw_contourc(self, ctrl_mat, colours):
         """Draws contour with cubic Bezier, initially a copy of draw_contour.
-        To loop correctly, last point of ctrl_mat must match first point.
+        The whole path is formatted at once, fly over are inted, flyby stay
+        floats. To loop correctly, last point of ctrl_mat must match first
+        point.
         ctrl_mat -- control points, (n, 2) float array
         colours -- dictionnary containing stroke and fill colour"""
         assert ctrl_mat[4:, ].shape[0] % 3 == 0
-        n_bezier = ctrl_mat[4:, ].shape[0] // 3  # Number of curves
+        instrument.RECORDER.count("curves written", len(ctrl_mat) // 3)
+        if self.decimals is None and not self.merge:
+            self.open_path()
+            self.write(self.absolute_path(ctrl_mat))
+            self.close_path(colours)
+        else:  # Formatted and merged by batches
+            self.paths.append((ctrl_mat, colours))
+            if len(self.paths) >= PATH_BATCH:
+                self.write_paths()
+
+    def draw_region(self, ctrl_mats, colours, fill_rule="nonzero"):
+        """Draws a zone bounded by several closed polybeziers, e.g. around
+        the zone and around its holes, as one path of several subpaths
+        ctrl_mats -- list of control matrices, see draw_contourc
+        colours -- dictionnary containing stroke and fill colour
+        fill_rule -- "nonzero" if the zone is on the same side of all the
+            polybeziers, "evenodd" for a polybezier around the zone followed
+            by ones around its holes, which are then reversed if needed to
+            turn the other way, so that merged paths stay right"""
+        instrument.RECORDER.count("curves written", sum(
+            len(ctrl_mat) // 3 for ctrl_mat in ctrl_mats))
+        self.write_paths()
+        if fill_rule == "evenodd":
+            # Signed areas of the control polygons give the orientations
+            areas = [np.sum(ctrl_mat[:-1, 0] * ctrl_mat[1:, 1] -
+                            ctrl_mat[1:, 0] * ctrl_mat[:-1, 1])
+                     for ctrl_mat in ctrl_mats]
+            ctrl_mats = [ctrl_mats[0]] + [
+                ctrl_mat[::-1] if area * areas[0] > 0 else ctrl_mat
+                for ctrl_mat, area in zip(ctrl_mats[1:], areas[1:])]
+        if self.decimals is None:
+            pathdata = " ".join(self.absolute_path(ctrl_mat) + " z"
+                                for ctrl_mat in ctrl_mats)
+        else:
+            pathdata = "".join(compact_paths(ctrl_mats, self.decimals))
+        if self.merge:
+            ctrls = np.concatenate(ctrl_mats)
+            margin = float(colours.get("stroke-width", 1)) / 2
+            bbox = np.concatenate((ctrls.min(axis=0) - margin,
+                                   ctrls.max(axis=0) + margin)).tolist()
+            self.merge_path(pathdata, colours, bbox)
+            return
         self.open_path()
-        self.begin_bezierc(ctrl_mat[:4, ])
-        for i in range(4, 4 + 3 * n_bezier, 3):
-            self.add_polybezierc(ctrl_mat[i:i + 3, ])
+        self.write(pathdata)
+        if len(ctrl_mats) > 1:
+            self.write("\" fill-rule=\"{}".format(fill_rule))
         self.close_path(colours)
 
+    def write_paths(self):
+        """Writes or merges the pending contours of draw_contourc"""
+        if not self.paths:
+            return
+        ctrl_mats, colourslist = zip(*self.paths)
+        self.paths = []
+        if self.decimals is None:
+            pathdatas = [self.absolute_path(ctrl_mat) + " z"
+                         for ctrl_mat in ctrl_mats]
+        else:
+            pathdatas = compact_paths(ctrl_mats, self.decimals)
+        if not self.merge:
+            for pathdata, colours in zip(pathdatas, colourslist):
+                self.open_path()
+                self.write(pathdata)
+                self.close_path(colours)
+            return
+        # Curves lie in the hull of their control points, stroke goes half
+        # a pixel further
+        ctrls = np.concatenate(ctrl_mats)
+        offsets = np.cumsum([0] + [len(ctrl_mat) for ctrl_mat in ctrl_mats])
+        bboxes = np.hstack(
+            (np.minimum.reduceat(ctrls, offsets[:-1]) - 0.5,
+             np.maximum.reduceat(ctrls, offsets[:-1]) + 0.5)).tolist()
+        for pathdata, colours, bbox in zip(pathdatas, colourslist, bboxes):
+            self.merge_path(pathdata, colours, bbox)
+
+    def absolute_path(self, ctrl_mat):
+        """Path data of draw_contourc with absolute coordinates"""
+        n_bezier = ctrl_mat[4:, ].shape[0] // 3  # Number of curves
+        pathformat = "M %d %d C %.6f %.6f, %.6f %.6f, %d %d" + \
+            ", %.6f %.6f, %.6f %.6f, %d %d" * n_bezier
+        return pathformat % tuple(ctrl_mat.ravel().tolist())
+
     def draw_pix(self, pix):
         """Draws a pixel on svg, to see contour results, only for demos...
         pix -- image_elemnts.Pixel() element
@@ -130,5 +393,7 @@ class SvgFile(object):
         """Draws pixels from contour
         contour -- Contour object
         """
-        for pix in contour.xys:
-            self.draw_pix(pix)
+        r = (self.dim[0] + self.dim[1]) * 1e-3 / 2
+        pixformat = "\t<circle cx=\"%d\" cy=\"%d\" r=\"{}\"/>\n".format(r)
+        self.write((pixformat * len(contour.xys)) %
+                   tuple(contour.xys.ravel().tolist()))